@@ -0,0 +1,157 @@
+"""Cold storage tier: database size before and after archiving idle
+sessions, the compression ratio with and without a shared dictionary, and
+the latency of reading a hot session against an archived one.
+
+Sessions are seeded with templated chat text (questions, markdown answers,
+source URLs) so that they share vocabulary the way real chats do.
+
+    uv run python -m benchmarks.bench_archive --sessions 5000 --messages 20 --reads 500
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sessions", type=int, default=5000)
+parser.add_argument("--messages", type=int, default=20)
+parser.add_argument("--idle-share", type=float, default=0.8)
+parser.add_argument("--reads", type=int, default=500)
+parser.add_argument("--page", type=int, default=100)
+parser.add_argument("--no-dictionary", action="store_true")
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp()
+db_path = os.path.join(workdir, "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+if args.no_dictionary:
+    os.environ["ARCHIVE_DICT_MIN_SAMPLES"] = str(10 ** 9)
+
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import sqlite3  # noqa: E402
+import statistics  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+
+from src.chatbot.scheduler import percentile  # noqa: E402
+from src.database.archive import SessionArchiver, archive_summary  # noqa: E402
+from src.database.db import list_session_messages  # noqa: E402
+from src.database.models import SessionLocal, engine, init_db  # noqa: E402
+
+TOPICS = ["docker compose", "python asyncio", "postgres indexes", "react hooks", "kubernetes ingress",
+          "rust lifetimes", "git rebase", "nginx caching", "pandas groupby", "tls certificates"]
+VERBS = ["configure", "debug", "speed up", "explain", "migrate", "test", "secure", "deploy"]
+PHRASES = [
+    "Here is a step-by-step approach you can follow.",
+    "The most common cause of this error is a misconfigured environment variable.",
+    "You can verify the change by running the command again and checking the logs.",
+    "In short, prefer the simpler option unless you need the extra flexibility.",
+    "Make sure the version you install matches the one in your lockfile.",
+    "This keeps the configuration in one place and makes it easier to review.",
+]
+
+
+def message(rng, sender):
+    topic = rng.choice(TOPICS)
+    if sender == "user":
+        return f"How do I {rng.choice(VERBS)} {topic} when {rng.choice(TOPICS)} is involved? I tried {rng.randint(2, 9)} things already."
+    steps = "\n".join(f"{i}. {rng.choice(PHRASES)} Use `{topic.split()[0]} --{rng.choice(VERBS).split()[0]}`." for i in range(1, rng.randint(3, 7)))
+    return f"## {topic.title()}\n\n{rng.choice(PHRASES)}\n\n{steps}\n\n{rng.choice(PHRASES)}"
+
+
+def seed():
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    idle = now - timedelta(days=365)
+    idle_sessions = int(args.sessions * args.idle_share)
+
+    raw = sqlite3.connect(db_path)
+    cur = raw.cursor()
+    cur.execute(
+        "INSERT INTO users (id, user_name, user_email_id, user_password, create_at) VALUES (1, 'bench', 'bench@example.com', 'x', ?)",
+        (str(now),)
+    )
+    cur.executemany(
+        "INSERT INTO sessions (id, user_id, title, created_at, last_message, last_message_at) VALUES (?, 1, ?, ?, '', ?)",
+        (
+            (s, f"Chat {s}", str(idle), str(idle if s <= idle_sessions else now))
+            for s in range(1, args.sessions + 1)
+        )
+    )
+    cur.executemany(
+        "INSERT INTO messages (session_id, sender, message, urls, created_at) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                s, sender, message(rng, sender),
+                json.dumps(json.dumps([f"https://docs.example.com/{rng.choice(TOPICS).replace(' ', '-')}"] if sender == "ai" else [])),
+                str(idle + timedelta(seconds=m))
+            )
+            for s in range(1, args.sessions + 1)
+            for m in range(args.messages)
+            for sender in ["user" if m % 2 == 0 else "ai"]
+        )
+    )
+    raw.commit()
+    raw.close()
+    return idle_sessions
+
+
+def database_bytes():
+    # Checkpoint and vacuum so the file size reflects live pages only.
+    raw = sqlite3.connect(db_path)
+    raw.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    raw.execute("VACUUM")
+    raw.close()
+    return os.path.getsize(db_path)
+
+
+async def read_latency(session_ids):
+    samples = []
+    async with SessionLocal() as db:
+        for session_id in session_ids:
+            start = time.perf_counter()
+            await list_session_messages(db=db, user_id=1, session_id=session_id, limit=args.page)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<16} p50 {statistics.median(samples) * 1000:6.2f} ms  p95 {percentile(samples, 0.95) * 1000:6.2f} ms")
+
+
+async def main():
+    await init_db()
+    idle_sessions = seed()
+    await engine.dispose()
+    before = database_bytes()
+    print(f"seeded {args.sessions} sessions x {args.messages} messages, {idle_sessions} idle; "
+          f"database {before / 1e6:.1f} MB")
+
+    rng = random.Random(3)
+    hot = [rng.randint(idle_sessions + 1, args.sessions) for _ in range(args.reads)]
+    cold = [rng.randint(1, idle_sessions) for _ in range(args.reads)]
+    report("hot, before", await read_latency(hot))
+
+    archiver = SessionArchiver(after_days=30, pause=0)
+    start = time.perf_counter()
+    archived = await archiver.run_once()
+    elapsed = time.perf_counter() - start
+    async with SessionLocal() as db:
+        summary = await archive_summary(db)
+    await engine.dispose()
+    after = database_bytes()
+
+    print(f"archived {archived} sessions in {elapsed:.1f}s "
+          f"({'no dictionary' if args.no_dictionary else 'shared dictionary'})")
+    print(f"  payload {summary['raw_bytes'] / 1e6:.1f} MB -> {summary['stored_bytes'] / 1e6:.2f} MB "
+          f"(ratio {summary['ratio']})")
+    print(f"  database {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+          f"(saved {(before - after) / 1e6:.1f} MB, {(before - after) / before:.0%})")
+
+    report("hot, after", await read_latency(hot))
+    report("archived", await read_latency(cold))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Cold import time of ``src.app``, parsed from ``python -X importtime``.
+Each run is a fresh interpreter, so this is what every worker, test run and
+CLI import pays before the first request. ``--ref`` also measures the tree
+at a git revision (extracted with ``git archive``) for a before/after view.
+
+    uv run python -m benchmarks.bench_import_time --runs 5 --ref HEAD~1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument("--module", default="src.app")
+parser.add_argument("--ref", help="git revision to compare against, e.g. HEAD~1")
+parser.add_argument("--top", type=int, default=8)
+args = parser.parse_args()
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once(cwd: str):
+    env = dict(os.environ)
+    # Older trees read the keys at import time; the values are never used.
+    env.setdefault("TAVILY_API_KEY", "bench")
+    env.setdefault("GOOGLE_API_KEY", "bench")
+    env["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+        cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr.strip().splitlines()[-1])
+
+    # "import time: self [us] | cumulative | imported package"
+    # Nesting is shown by indenting the name, and a module is printed after
+    # everything it imported.
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        rows.append((name.strip(), int(cum) / 1e6, depth))
+    return rows
+
+
+def breakdown(rows):
+    # The measured module and the imports directly beneath it.
+    for i in range(len(rows) - 1, -1, -1):
+        name, total, depth = rows[i]
+        if name == args.module:
+            break
+    children = []
+    for child, t, child_depth in reversed(rows[:i]):
+        if child_depth <= depth:
+            break
+        if child_depth == depth + 2:
+            children.append((child, t))
+    return total, children
+
+
+def measure(label: str, cwd: str):
+    runs = [import_once(cwd) for _ in range(args.runs)]
+    totals = [breakdown(rows)[0] for rows in runs]
+    _, children = breakdown(runs[-1])
+
+    print(f"{label}: {args.module} median {statistics.median(totals) * 1000:.0f} ms "
+          f"(min {min(totals) * 1000:.0f} ms, {args.runs} runs)")
+    for name, t in sorted(children, key=lambda item: -item[1])[:args.top]:
+        print(f"  {t * 1000:8.1f} ms  {name}")
+    return statistics.median(totals)
+
+
+def extract(ref: str, target: str):
+    archive = subprocess.run(
+        ["git", "archive", ref, "."], cwd=BACKEND, capture_output=True, check=True
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+
+
+if __name__ == "__main__":
+    current = measure("working tree", BACKEND)
+    if args.ref:
+        with tempfile.TemporaryDirectory() as target:
+            extract(args.ref, target)
+            before = measure(args.ref, target)
+        print(f"speedup {before / current:.2f}x ({(before - current) * 1000:.0f} ms saved per import)")
@@ -0,0 +1,307 @@
+"""Mixed-traffic load test of the whole app with local stand-ins for Ollama
+and Tavily, so runs are reproducible and can be compared across commits.
+
+The app runs in-process (lifespan included) against a temporary SQLite
+database. Ollama is a stub HTTP server that waits ``--ttft`` and then emits
+``--answer-tokens`` tokens at ``--token-rate`` per second; Tavily is a fake
+client with ``--search-latency``. ``--concurrency`` virtual users each
+register and log in, then send a seeded random mix of plain, web search and
+streaming chats, session listings and history fetches until ``--requests``
+requests have been sent.
+
+Per operation it reports throughput, p50/p95/p99 latency, status codes and
+SQL statements per request, plus the mean time per chat stage from the
+app's own metrics, and writes everything to a JSON file. ``--compare``
+prints the change against an earlier result file.
+
+    uv run python -m benchmarks.bench_load --concurrency 16 --requests 400
+    LLM_MAX_CONCURRENCY=8 uv run python -m benchmarks.bench_load --compare benchmarks/results/previous.json
+
+App settings (LLM_MAX_CONCURRENCY, WRITE_BEHIND_MODE, ...) are read from
+the environment as usual and recorded in the result file.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--requests", type=int, default=400)
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--ttft", type=float, default=0.15, help="stub Ollama seconds before the first token")
+parser.add_argument("--token-rate", type=float, default=200, help="stub Ollama tokens per second")
+parser.add_argument("--answer-tokens", type=int, default=60)
+parser.add_argument("--search-latency", type=float, default=0.3, help="fake Tavily seconds per query")
+parser.add_argument("--bcrypt-rounds", type=int, default=12)
+parser.add_argument("--mix", default="chat=35,chat_web=15,chat_stream=10,sessions=20,history=20",
+                    help="relative weights of the operations after login")
+parser.add_argument("--out", default=None, help="result file (default benchmarks/results/<time>.json)")
+parser.add_argument("--compare", default=None, help="earlier result file to compare against")
+args = parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+PORT = free_port()
+workdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+os.environ["SEARCH_CACHE_PATH"] = os.path.join(workdir, "search_cache.db")
+os.environ["HISTORY_INDEX_DIR"] = os.path.join(workdir, "history_index")
+os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+import asyncio  # noqa: E402
+import random  # noqa: E402
+import statistics  # noqa: E402
+from contextvars import ContextVar  # noqa: E402
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from src.app import app  # noqa: E402
+from src.chatbot import providers  # noqa: E402
+from src.chatbot.scheduler import percentile  # noqa: E402
+from src.database.models import engine  # noqa: E402
+from src.utils.metrics import stage_duration  # noqa: E402
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(payload: dict):
+            data = json.dumps(payload).encode() + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        time.sleep(args.ttft)
+        for i in range(args.answer_tokens):
+            chunk({"model": body["model"], "response": f" word{i}", "done": False})
+            time.sleep(1 / args.token_rate)
+        chunk({"model": body["model"], "response": "", "done": True, "done_reason": "stop",
+               "eval_count": args.answer_tokens})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeTavily:
+    async def ainvoke(self, payload: dict) -> dict:
+        await asyncio.sleep(args.search_latency)
+        query = payload["query"]
+        return {
+            "query": query,
+            "answer": f"A short answer about {query}.",
+            "results": [
+                {"title": f"{query} ({i})", "url": f"https://example.com/{zlib.crc32(query.encode()) % 1000}/{i}",
+                 "content": f"{query}. " + "Background sentence about the topic. " * 40}
+                for i in range(2)
+            ],
+        }
+
+
+QUESTIONS = [
+    "How do I keep a sourdough starter alive?",
+    "Explain the difference between TCP and UDP",
+    "What should I pack for a weekend hike?",
+    "Summarize the causes of the French Revolution",
+    "How does compound interest work?",
+    "Write a short poem about autumn rain",
+]
+
+current_op: ContextVar[str] = ContextVar("current_op", default="background")
+statements = {}
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    op = current_op.get()
+    statements[op] = statements.get(op, 0) + 1
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    def add(self, op: str, elapsed: float, status):
+        self.latencies.setdefault(op, []).append(elapsed)
+        counts = self.statuses.setdefault(op, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+
+
+async def timed(recorder: Recorder, op: str, call):
+    current_op.set(op)
+    start = time.perf_counter()
+    try:
+        response = await call()
+        status = response.status_code
+    except Exception as exc:
+        response, status = None, type(exc).__name__
+    recorder.add(op, time.perf_counter() - start, status)
+    return response
+
+
+async def virtual_user(client, recorder: Recorder, index: int, budget: list, mix):
+    rng = random.Random(args.seed * 1000 + index)
+    credentials = {"user_email_id": f"load{index}@example.com", "user_password": "load-password"}
+    await timed(recorder, "register", lambda: client.post("/api/register", json={"user_name": f"load{index}", **credentials}))
+    response = await timed(recorder, "login", lambda: client.post("/api/login", json=credentials))
+    if response is None or response.status_code != 200:
+        return
+    login = response.json()
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+    user_id = login["user_id"]
+    session_id = None
+
+    ops, weights = zip(*mix)
+    while budget[0] > 0:
+        budget[0] -= 1
+        op = rng.choices(ops, weights)[0]
+        if op == "history" and session_id is None:
+            op = "sessions"
+        if op in ("chat", "chat_web", "chat_stream"):
+            body = {
+                "message": rng.choice(QUESTIONS),
+                "user_id": user_id,
+                "use_web_search": op == "chat_web",
+                "role": rng.choice(["assistant", "friend"]),
+            }
+            # Continue the current session about half the time.
+            if session_id is not None and rng.random() < 0.5:
+                body["session_id"] = session_id
+            path = "/api/chat/stream" if op == "chat_stream" else "/api/chat"
+            response = await timed(recorder, op, lambda: client.post(path, headers=headers, json=body))
+            if response is not None and response.status_code == 200 and op != "chat_stream":
+                session_id = response.json()["session_id"]
+        elif op == "sessions":
+            await timed(recorder, op, lambda: client.get(f"/api/users/{user_id}/sessions", headers=headers))
+        elif op == "history":
+            await timed(recorder, op, lambda: client.get(f"/api/users/{user_id}/sessions/{session_id}", headers=headers))
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    ops = {}
+    for op, samples in recorder.latencies.items():
+        ops[op] = {
+            "count": len(samples),
+            "throughput": round(len(samples) / elapsed, 2),
+            "p50_ms": round(statistics.median(samples) * 1000, 1),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 1),
+            "mean_ms": round(statistics.mean(samples) * 1000, 1),
+            "statuses": recorder.statuses[op],
+            "db_statements_per_request": round(statements.get(op, 0) / len(samples), 2),
+        }
+    stages = {
+        key[0]: {"count": count, "mean_ms": round(total / count * 1000, 2)}
+        for key, (_, total, count) in stage_duration._series.items() if count
+    }
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": sum(len(s) for s in recorder.latencies.values()),
+        "throughput": round(sum(len(s) for s in recorder.latencies.values()) / elapsed, 2),
+        "ops": ops,
+        "background_db_statements": statements.get("background", 0),
+        "stages": stages,
+    }
+
+
+def report(result: dict):
+    print(f"{result['requests']} requests in {result['elapsed_s']}s, {result['throughput']} req/s")
+    print(f"{'op':12}{'count':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'stmts':>7}  statuses")
+    for op, s in result["ops"].items():
+        print(f"{op:12}{s['count']:7}{s['throughput']:8}{s['p50_ms']:9}{s['p95_ms']:9}{s['p99_ms']:9}"
+              f"{s['db_statements_per_request']:7}  {s['statuses']}")
+    print("stage means (ms):", ", ".join(f"{k} {v['mean_ms']}" for k, v in result["stages"].items()))
+
+
+def compare(result: dict, path: str):
+    with open(path) as f:
+        before = json.load(f)["result"]
+
+    def change(new, old):
+        return f"{(new - old) / old * 100:+6.1f}%" if old else "     n/a"
+
+    print(f"vs {path}: throughput {before['throughput']} -> {result['throughput']} "
+          f"({change(result['throughput'], before['throughput']).strip()})")
+    for op, s in result["ops"].items():
+        old = before["ops"].get(op)
+        if old:
+            print(f"  {op:12} p95 {old['p95_ms']:8} -> {s['p95_ms']:8} {change(s['p95_ms'], old['p95_ms'])}"
+                  f"   p99 {old['p99_ms']:8} -> {s['p99_ms']:8} {change(s['p99_ms'], old['p99_ms'])}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    providers.tavily.client = FakeTavily()
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+
+    mix = [(op, float(weight)) for op, weight in (part.split("=") for part in args.mix.split(","))]
+    recorder = Recorder()
+    budget = [args.requests]
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                start = time.perf_counter()
+                await asyncio.gather(*(
+                    virtual_user(client, recorder, i, budget, mix) for i in range(args.concurrency)
+                ))
+                elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    result = summarize(recorder, elapsed)
+    report(result)
+    if args.compare:
+        compare(result, args.compare)
+
+    out = args.out or os.path.join(
+        os.path.dirname(__file__), "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    settings = {k: v for k, v in os.environ.items() if k.startswith((
+        "LLM_", "OLLAMA_", "WRITE_BEHIND_", "SQLITE_", "DB_", "SEARCH_", "SEMANTIC_CACHE_",
+        "SINGLE_FLIGHT_", "CONTEXT_", "MEMORY_", "PROMPT_PREFIX_", "BCRYPT_"
+    )) and k != "OLLAMA_BASE_URL"}
+    with open(out, "w") as f:
+        json.dump({
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "args": vars(args),
+            "settings": settings,
+            "result": result,
+        }, f, indent=2)
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
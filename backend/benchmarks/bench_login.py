@@ -0,0 +1,77 @@
+"""Login throughput against the in-process app, to size BCRYPT_ROUNDS and
+BCRYPT_WORKERS. While logins run, a probe measures how long a cheap request
+waits behind them, which shows whether bcrypt is stalling the event loop.
+
+    uv run python -m benchmarks.bench_login --requests 200 --concurrency 16 --rounds 12 --workers 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--requests", type=int, default=200)
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--rounds", type=int, default=12)
+parser.add_argument("--workers", type=int, default=4)
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+os.environ["BCRYPT_WORKERS"] = str(args.workers)
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+import asyncio  # noqa: E402
+import statistics  # noqa: E402
+
+import httpx  # noqa: E402
+
+from src.app import app  # noqa: E402
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def main():
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            credentials = {"user_email_id": "bench@example.com", "user_password": "bench-password"}
+            await client.post("/api/register", json={"user_name": "bench", **credentials})
+
+            latencies, probes = [], []
+            semaphore = asyncio.Semaphore(args.concurrency)
+            done = asyncio.Event()
+
+            async def login():
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/api/login", json=credentials)
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+
+            async def probe():
+                while not done.is_set():
+                    start = time.perf_counter()
+                    await asyncio.sleep(0.01)
+                    probes.append(time.perf_counter() - start - 0.01)
+
+            probe_task = asyncio.create_task(probe())
+            start = time.perf_counter()
+            await asyncio.gather(*(login() for _ in range(args.requests)))
+            elapsed = time.perf_counter() - start
+            done.set()
+            await probe_task
+
+    print(f"rounds={args.rounds} workers={args.workers} concurrency={args.concurrency}")
+    print(f"logins/s      {args.requests / elapsed:8.1f}")
+    print(f"latency p50   {statistics.median(latencies) * 1000:8.1f} ms")
+    print(f"latency p95   {percentile(latencies, 0.95) * 1000:8.1f} ms")
+    print(f"loop lag p99  {percentile(probes, 0.99) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+"""Prefill cost per turn of a long session, rebuilt prompts vs session-affine
+prompt transcripts, against a local stub of Ollama's /api/generate.
+
+The stub keeps the tokens of the last prompt per slot, like the llama.cpp
+runner behind Ollama, and only "prefills" (sleeps for) the tokens after the
+longest common prefix. Summaries requested by the conversation memory go
+through the same stub and compete for its slots.
+
+    uv run python -m benchmarks.bench_prefix_reuse --turns 20 --prefill-ms 0.5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--turns", type=int, default=20)
+parser.add_argument("--prefill-ms", type=float, default=0.5, help="stub prefill time per token")
+parser.add_argument("--slots", type=int, default=2, help="stub OLLAMA_NUM_PARALLEL")
+parser.add_argument("--answer-words", type=int, default=80)
+args = parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+PORT = free_port()
+os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+import asyncio  # noqa: E402
+from collections import namedtuple  # noqa: E402
+from functools import partial  # noqa: E402
+
+from src.chatbot import ai_model, generation  # noqa: E402
+from src.chatbot.memory import ConversationMemory  # noqa: E402
+
+Row = namedtuple("Row", "id sender message")
+
+
+def tokenize(text: str):
+    return re.findall(r"\s+|\w+|[^\w\s]", text)
+
+
+class StubOllama:
+    def __init__(self, slots: int):
+        self.lock = threading.Lock()
+        self.slots = [[] for _ in range(slots)]
+        self.log = []
+
+    def generate(self, prompt: str, answer: str):
+        tokens = tokenize(prompt)
+        with self.lock:
+            def shared(slot):
+                n = 0
+                for a, b in zip(slot, tokens):
+                    if a != b:
+                        break
+                    n += 1
+                return n
+            # Reuse the slot sharing the longest prefix, else the oldest one.
+            best = max(range(len(self.slots)), key=lambda i: shared(self.slots[i]))
+            reused = shared(self.slots[best])
+            if reused == 0:
+                best = 0
+            slot = self.slots.pop(best)
+            self.slots.append(tokens + tokenize(answer))
+            del slot
+
+        prefill = len(tokens) - reused
+        time.sleep(prefill * args.prefill_ms / 1000)
+        self.log.append({"prompt_tokens": len(tokens), "prefill_tokens": prefill,
+                         "prefill_s": prefill * args.prefill_ms / 1000})
+        return prefill
+
+
+stub = StubOllama(args.slots)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *a):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["prompt"]
+        if prompt.startswith("\nCondense"):
+            answer = " Summary of the earlier turns."
+        else:
+            n = prompt.count("User: ")
+            answer = " " + " ".join(f"answer{n}word{i}" for i in range(args.answer_words))
+        prefill = stub.generate(prompt, answer)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for word in re.findall(r"\s*\S+", answer):
+            self.wfile.write(json.dumps({"model": body["model"], "response": word, "done": False}).encode() + b"\n")
+        self.wfile.write(json.dumps({
+            "model": body["model"], "response": "", "done": True, "done_reason": "stop",
+            "prompt_eval_count": prefill, "eval_count": args.answer_words
+        }).encode() + b"\n")
+
+
+async def session(affine: bool, session_id: int):
+    generation.session_prompts.enabled = affine
+    memory = ConversationMemory(summarize=partial(generation.summarize, ai_model))
+    rows, turns = [], []
+    for turn in range(args.turns):
+        message = f"Question {turn}: " + " ".join(f"detail{turn}x{i}" for i in range(40))
+        before = len(stub.log)
+        start = time.perf_counter()
+        history = await memory.build(session_id, [r for r in rows if r.id > memory.summary_cursor(session_id)])
+        rows.append(Row(len(rows) + 1, "user", message))
+
+        req = generation.AIRequest(
+            role="assistant", use_web_search=False, message=message, session_id=session_id
+        )
+        result = await generation.generate(ai_model, req, history)
+        elapsed = time.perf_counter() - start
+        rows.append(Row(len(rows) + 1, "ai", result["answer"]))
+
+        generate = stub.log[-1]
+        summarize = sum(entry["prefill_tokens"] for entry in stub.log[before:-1])
+        turns.append((generate["prompt_tokens"], generate["prefill_tokens"], summarize, elapsed))
+    return turns
+
+
+def report(label, turns):
+    print(label)
+    print("  turn  prompt  prefilled  summary-prefill  wall ms")
+    for i, (prompt, prefill, summarize, elapsed) in enumerate(turns, 1):
+        print(f"  {i:4}  {prompt:6}  {prefill:9}  {summarize:15}  {elapsed * 1000:7.1f}")
+    prefilled = sum(t[1] + t[2] for t in turns)
+    wall = sum(t[3] for t in turns)
+    print(f"  total prefilled {prefilled} tokens, wall {wall:.2f}s")
+    return prefilled, wall
+
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # The module prints every request and reply.
+        with contextlib.redirect_stdout(io.StringIO()):
+            rebuilt = await session(False, 1)
+            stub.slots = [[] for _ in range(args.slots)]
+            affine = await session(True, 2)
+    finally:
+        server.shutdown()
+
+    base = report("rebuilt prompt every turn", rebuilt)
+    reuse = report("session-affine transcript", affine)
+    print(f"prefill tokens {base[0]} -> {reuse[0]} ({base[0] / max(reuse[0], 1):.1f}x fewer), "
+          f"wall {base[1]:.2f}s -> {reuse[1]:.2f}s")
+    print("prefix stats", generation.session_prompts.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""Fairness and admission control of the LLM scheduler against a stub model
+with a fixed service time and ``--parallel`` slots, like a single Ollama
+instance. One heavy user fires a burst while light users send a request
+each; without the scheduler the light users wait behind the whole burst.
+
+    uv run python -m benchmarks.bench_scheduler --service-time 0.05 --burst 60 --light-users 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+from src.chatbot.scheduler import FairScheduler, Overloaded, percentile  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--service-time", type=float, default=0.05)
+parser.add_argument("--parallel", type=int, default=2)
+parser.add_argument("--burst", type=int, default=60)
+parser.add_argument("--light-users", type=int, default=10)
+parser.add_argument("--queue-max", type=int, default=48)
+parser.add_argument("--queue-max-per-user", type=int, default=8)
+parser.add_argument("--timeout", type=float, default=30)
+args = parser.parse_args()
+
+
+class StubModel:
+    def __init__(self):
+        self.slots = asyncio.Semaphore(args.parallel)
+
+    async def generate(self):
+        async with self.slots:
+            await asyncio.sleep(args.service_time)
+
+
+async def run(scheduler):
+    model = StubModel()
+    latencies = {"heavy": [], "light": []}
+    rejected = {"heavy": 0, "light": 0}
+
+    async def call(kind, user_id, delay):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        try:
+            if scheduler is None:
+                await model.generate()
+            else:
+                async with scheduler.slot(user_id):
+                    await model.generate()
+        except Overloaded:
+            rejected[kind] += 1
+            return
+        latencies[kind].append(time.perf_counter() - start)
+
+    # The burst lands first; light users arrive just behind it.
+    calls = [call("heavy", "heavy", 0) for _ in range(args.burst)]
+    calls += [call("light", f"light-{i}", 0.001) for i in range(args.light_users)]
+    await asyncio.gather(*calls)
+    return latencies, rejected
+
+
+def report(label, latencies, rejected):
+    print(label)
+    for kind in ("heavy", "light"):
+        samples = latencies[kind]
+        if not samples:
+            print(f"  {kind:5}  all {rejected[kind]} rejected")
+            continue
+        print(f"  {kind:5}  p50 {statistics.median(samples) * 1000:7.1f} ms  "
+              f"p95 {percentile(samples, 0.95) * 1000:7.1f} ms  rejected {rejected[kind]}")
+
+
+async def main():
+    report("no scheduler (model queue, FIFO)", *await run(None))
+
+    scheduler = FairScheduler(
+        concurrency=args.parallel,
+        queue_max=args.queue_max,
+        queue_max_per_user=args.queue_max_per_user,
+        timeout=args.timeout
+    )
+    label = f"fair scheduler (concurrency {args.parallel}, queue {args.queue_max}/{args.queue_max_per_user} per user)"
+    report(label, *await run(scheduler))
+    print("  stats", scheduler.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
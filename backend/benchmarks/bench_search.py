@@ -0,0 +1,145 @@
+"""History search on a synthetic corpus: a LIKE '%term%' scan of the user's
+messages against the FTS5 index behind /users/{user_id}/search.
+
+The corpus has --messages rows over --users users, and one heavy user owns
+--heavy-share of them. Words follow a Zipf distribution, so the queries
+cover both rare and common terms.
+
+    uv run python -m benchmarks.bench_search --messages 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--messages", type=int, default=1_000_000)
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--sessions-per-user", type=int, default=10)
+parser.add_argument("--heavy-share", type=float, default=0.1)
+parser.add_argument("--vocabulary", type=int, default=50_000)
+parser.add_argument("--words", type=int, default=20)
+parser.add_argument("--repeat", type=int, default=5)
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp()
+path = os.path.join(workdir, "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+
+import asyncio  # noqa: E402
+
+from src.database.db import search_user_messages  # noqa: E402
+from src.database.models import SessionLocal, engine, init_db, rebuild_message_search  # noqa: E402
+
+
+def word(i: int) -> str:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    i += 26 * 26
+    while i:
+        i, r = divmod(i, 26)
+        out += letters[r]
+    return out
+
+
+VOCABULARY = [word(i) for i in range(args.vocabulary)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(args.vocabulary)))
+
+
+def corpus():
+    rng = random.Random(7)
+    heavy = int(args.messages * args.heavy_share)
+    per_session = max(1, (args.messages - heavy) // (args.users * args.sessions_per_user))
+    for n in range(args.messages):
+        if n < heavy:
+            session_id = 1 + n * args.sessions_per_user // heavy
+        else:
+            session_id = 1 + args.sessions_per_user + (n - heavy) // per_session
+        text = " ".join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=args.words))
+        yield session_id, "user" if n % 2 == 0 else "ai", text, "[]", "2026-01-01 00:00:00"
+
+
+def load():
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    sessions = args.sessions_per_user * (args.users + 1)
+    conn.executemany("INSERT INTO users (id, user_name, user_email_id, user_password) VALUES (?, ?, ?, ?)",
+                     [(u, f"u{u}", f"u{u}@example.com", "x") for u in range(1, args.users + 2)])
+    conn.executemany("INSERT INTO sessions (id, user_id, title) VALUES (?, ?, ?)",
+                     [(s, 1 + (s - 1) // args.sessions_per_user, "t") for s in range(1, sessions + 1)])
+    start = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO messages (session_id, sender, message, urls, created_at) VALUES (?, ?, ?, ?, ?)",
+        corpus()
+    )
+    conn.commit()
+    elapsed = time.perf_counter() - start
+    # Fold the bulk load out of the WAL so queries read the main file.
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return elapsed
+
+
+def like_search(user_id: int, query: str):
+    # Unranked and substring based, so it can stop at the first 20 hits;
+    # its cost grows with the user's history when there are few hits.
+    terms = query.split()
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT m.id FROM messages m JOIN sessions s ON s.id = m.session_id "
+        "WHERE s.user_id = ? AND " + " AND ".join("m.message LIKE ?" for _ in terms) +
+        " ORDER BY m.id DESC LIMIT 20",
+        (user_id, *[f"%{t}%" for t in terms])
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def timed(fn, repeat=args.repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+async def main():
+    await init_db()
+    await engine.dispose()
+    load_s = load()
+    print(f"loaded {args.messages} messages (FTS triggers on) in {load_s:.1f}s "
+          f"({args.messages / load_s:,.0f}/s), db {os.path.getsize(path) / 2**20:.0f} MiB")
+
+    cases = [("heavy user", 1), ("typical user", args.users // 2 + 1)]
+    terms = [("rare term", VOCABULARY[-7]), ("common term", VOCABULARY[3]),
+             ("two terms", f"{VOCABULARY[40]} {VOCABULARY[90]}")]
+
+    print(f"{'':14}{'query':13}{'LIKE scan':>12}{'FTS5 bm25':>12}{'hits':>6}")
+    async with SessionLocal() as db:
+        for label, user_id in cases:
+            for term_label, term in terms:
+                like_s, _ = timed(lambda: like_search(user_id, term))
+                samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    hits = await search_user_messages(db, user_id, term, limit=20)
+                    samples.append(time.perf_counter() - start)
+                fts_s = statistics.median(samples)
+                print(f"{label:14}{term_label:13}{like_s * 1000:10.1f}ms{fts_s * 1000:10.1f}ms{len(hits):6}")
+    await engine.dispose()
+
+    start = time.perf_counter()
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_message_search)
+    await engine.dispose()
+    print(f"full backfill (rebuild) of the index: {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""Web search stage against a fake Tavily client with injected latency and
+failures: one query as before, against the multi-query fan-out with a
+deadline.
+
+The fake answers each query with ``--max-results`` hits from a small pool of
+URLs (with tracking parameters, so deduplication has work to do), after a
+log-normal delay; ``--failure-rate`` of the calls raise and ``--hang-rate``
+never return in time.
+
+    uv run python -m benchmarks.bench_search_fanout --chats 200 --deadline 1.5
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from src.chatbot.scheduler import percentile
+from src.chatbot.search_fanout import SearchFanout, canonical_url
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--chats", type=int, default=200)
+parser.add_argument("--queries", type=int, default=3)
+parser.add_argument("--deadline", type=float, default=1.5)
+parser.add_argument("--max-results", type=int, default=2)
+parser.add_argument("--median-latency", type=float, default=0.6)
+parser.add_argument("--failure-rate", type=float, default=0.05)
+parser.add_argument("--hang-rate", type=float, default=0.03)
+parser.add_argument("--client-timeout", type=float, default=10)
+args = parser.parse_args()
+
+QUESTIONS = [
+    "What is the population of Tokyo and how does it compare to Osaka?",
+    "Best practices for Python packaging, wheels vs sdists",
+    "How tall is the Eiffel Tower and when was it built?",
+    "Symptoms of vitamin D deficiency; recommended daily intake",
+]
+
+
+class FakeTavily:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+    async def ainvoke(self, payload: dict) -> dict:
+        query = payload["query"]
+        roll = self.rng.random()
+        if roll < args.hang_rate:
+            await asyncio.sleep(60)
+        await asyncio.sleep(self.rng.lognormvariate(0, 0.5) * args.median_latency)
+        if roll < args.hang_rate + args.failure_rate:
+            raise RuntimeError("HTTP 502 from search backend")
+
+        words = query.lower().split()
+        pool = [f"https://www.{w.strip('?,;')}.example.com/wiki" for w in words if len(w) > 3]
+        picks = self.rng.sample(pool, min(args.max_results, len(pool)))
+        return {
+            "query": query,
+            "answer": f"Summary for {query}",
+            "results": [
+                {"title": url, "url": f"{url}?utm_source={self.rng.randint(1, 9)}", "content": f"About {url}."}
+                for url in picks
+            ],
+        }
+
+
+async def single(search, question, timeout=None):
+    try:
+        value = await asyncio.wait_for(search.ainvoke({"query": question}), timeout)
+    except Exception:
+        return []
+    return value.get("results", [])
+
+
+async def run(label, search, timeout=None):
+    async def chat(i):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        start = time.perf_counter()
+        results = await single(search, question, timeout)
+        return time.perf_counter() - start, results
+
+    # Chats run concurrently; each one waits only for its own searches.
+    outcomes = await asyncio.gather(*(chat(i) for i in range(args.chats)))
+    latencies = [elapsed for elapsed, _ in outcomes]
+    counts = [len({canonical_url(r["url"]) for r in results}) for _, results in outcomes]
+    empty = sum(not results for _, results in outcomes)
+
+    print(f"{label:32} p50 {statistics.median(latencies) * 1000:6.0f} ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:6.0f} ms  max {max(latencies) * 1000:6.0f} ms  "
+          f"distinct urls {statistics.mean(counts):.1f}  no results {empty}/{args.chats}")
+
+
+async def main():
+    # A hung call without the fan-out waits for the client timeout.
+    await run(f"single query, {args.client_timeout:.0f}s client timeout", FakeTavily(1), args.client_timeout)
+
+    fanout = SearchFanout(FakeTavily(1), queries=args.queries, deadline=args.deadline, max_results=5)
+    await run(f"fan-out x{args.queries}, deadline {args.deadline}s", fanout)
+    print("  stats", fanout.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""Sidebar listing: loading every session's messages for ``messages[-1]``
+versus the denormalized ``last_message`` projection with keyset pagination.
+
+    uv run python -m benchmarks.bench_session_listing --sessions 10000 --messages 100
+"""
+import argparse
+import os
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sessions", type=int, default=10000)
+parser.add_argument("--messages", type=int, default=100)
+parser.add_argument("--page", type=int, default=100)
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp()
+db_path = os.path.join(workdir, "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{db_path}"
+
+import asyncio  # noqa: E402
+import sqlite3  # noqa: E402
+from datetime import datetime  # noqa: E402
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.orm import selectinload  # noqa: E402
+
+from src.database.models import SessionLocal, ChatSession, init_db  # noqa: E402
+from src.database.db import list_user_sessions  # noqa: E402
+
+
+def seed():
+    now = str(datetime.utcnow())
+    raw = sqlite3.connect(db_path)
+    cur = raw.cursor()
+    cur.execute(
+        "INSERT INTO users (id, user_name, user_email_id, user_password, create_at) VALUES (1, 'bench', 'bench@example.com', 'x', ?)",
+        (now,)
+    )
+    cur.executemany(
+        "INSERT INTO sessions (id, user_id, title, created_at, last_message, last_message_at) VALUES (?, 1, ?, ?, ?, ?)",
+        ((s, f"Chat {s}", now, f"message {args.messages - 1}", now) for s in range(1, args.sessions + 1))
+    )
+    cur.executemany(
+        "INSERT INTO messages (session_id, sender, message, urls, created_at) VALUES (?, ?, ?, '[]', ?)",
+        (
+            (s, "user" if m % 2 == 0 else "ai", f"message {m}", now)
+            for s in range(1, args.sessions + 1)
+            for m in range(args.messages)
+        )
+    )
+    raw.commit()
+    raw.close()
+
+
+async def lazy_listing(db):
+    # The old handler touched s.messages on every session; under asyncio the
+    # equivalent has to load every session's messages eagerly.
+    sessions = await db.scalars(
+        select(ChatSession)
+        .where(ChatSession.user_id == 1)
+        .order_by(ChatSession.created_at.desc())
+        .options(selectinload(ChatSession.messages))
+    )
+    return [
+        {"id": s.id, "last_message": s.messages[-1].message if s.messages else ""}
+        for s in sessions
+    ]
+
+
+async def projected_listing(db):
+    rows, before = [], None
+    while True:
+        page = await list_user_sessions(db=db, user_id=1, before=before, limit=args.page)
+        if not page:
+            return rows
+        rows.extend(page)
+        before = page[-1].id
+
+
+async def first_page(db):
+    return await list_user_sessions(db=db, user_id=1, limit=args.page)
+
+
+async def timed(fn):
+    async with SessionLocal() as db:
+        start = time.perf_counter()
+        rows = await fn(db)
+        return time.perf_counter() - start, len(rows)
+
+
+async def main():
+    await init_db()
+    start = time.perf_counter()
+    seed()
+    print(f"seeded {args.sessions} sessions x {args.messages} messages in {time.perf_counter() - start:.1f}s")
+
+    for name, fn in [("load all messages", lazy_listing), ("projection, all pages", projected_listing), ("projection, first page", first_page)]:
+        elapsed, count = await timed(fn)
+        print(f"{name:<24} {elapsed * 1000:10.1f} ms  ({count} rows)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,49 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import ai_chatbot
+from .routes import ai_chatbot, ws_chat
+from .database.models import engine, init_db
+from .database.writer import chat_writer
+from .database.purge import session_purger
+from .database.archive import session_archiver
+from .database.indexer import history_indexer
+from .chatbot.providers import LLM_WARMUP, registry
+from .chatbot.scheduler import Overloaded
+from .utils.metrics import MetricsMiddleware, metrics
 
 import os
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    await chat_writer.start()
+    await session_purger.start()
+    await session_archiver.start()
+    await history_indexer.start()
+    if LLM_WARMUP:
+        await registry.warm_up()
+    yield
+    # Queued AI replies are committed before the worker exits.
+    await chat_writer.stop()
+    await history_indexer.stop()
+    await session_purger.stop()
+    await session_archiver.stop()
+    await engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,4 +53,13 @@ app.add_middleware(
     allow_headers= ["*"]
 )
 
-app.include_router(ai_chatbot.router, prefix="/api")
\ No newline at end of file
+# Outermost, so the duration covers CORS handling and the whole stream.
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(ai_chatbot.router, prefix="/api")
+app.include_router(ws_chat.router, prefix="/api")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
\ No newline at end of file
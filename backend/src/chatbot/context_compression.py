@@ -0,0 +1,175 @@
+from typing import List
+
+import logging
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from .memory import count_tokens
+
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_COMPRESSION_ENABLED = os.getenv("CONTEXT_COMPRESSION_ENABLED", "true").lower() == "true"
+# Tokens of web results that go into the prompt, titles and sources included.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+CONTEXT_PASSAGE_TOKENS = int(os.getenv("CONTEXT_PASSAGE_TOKENS", "96"))
+# Cosine similarity of term vectors above which a passage is a near-duplicate.
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def terms(text: str) -> List[str]:
+    return re.findall(r"\w+", unicodedata.normalize("NFKC", text).casefold())
+
+
+def format_results(results) -> str:
+    return "\n\n".join(f"{r['title']}\n{r['content']}\nSource: {r['url']}" for r in results)
+
+
+def split_passages(text: str, max_tokens: int) -> List[str]:
+    # Whole sentences, packed up to max_tokens; a longer sentence is cut
+    # into runs of words.
+    sentences = []
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            sentences.append((sentence, tokens))
+            continue
+        words = sentence.split()
+        step = max(1, len(words) * max_tokens // tokens)
+        for start in range(0, len(words), step):
+            run = " ".join(words[start:start + step])
+            sentences.append((run, count_tokens(run)))
+
+    passages, current, size = [], [], 0
+    for sentence, tokens in sentences:
+        if current and size + tokens > max_tokens:
+            passages.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += tokens
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def bm25_scores(query: List[str], documents: List[List[str]]) -> tuple:
+    """BM25 of every document against ``query`` from one (documents x
+    vocabulary) term-frequency matrix; also returns the matrix."""
+    vocabulary = {}
+    rows, cols = [], []
+    for i, doc in enumerate(documents):
+        for term in doc:
+            rows.append(i)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+
+    tf = np.zeros((len(documents), max(len(vocabulary), 1)), dtype=np.float32)
+    np.add.at(tf, (rows, cols), 1.0)
+
+    q = [vocabulary[t] for t in set(query) if t in vocabulary]
+    if not q:
+        return np.zeros(len(documents), dtype=np.float32), tf
+
+    n = len(documents)
+    df = np.count_nonzero(tf[:, q], axis=0)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    lengths = tf.sum(axis=1, keepdims=True)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+    f = tf[:, q]
+    return (idf * f * (BM25_K1 + 1) / (f + norm)).sum(axis=1), tf
+
+
+class ContextCompressor:
+    """Cuts web search results down to the passages that best answer the
+    question, within ``token_budget``.
+
+    Results are split into passages, ranked by BM25 against the question,
+    near-duplicates of an already chosen passage are dropped, and the rest
+    are packed best first. Passages go back under their result's title and
+    ``Source:`` line in the original order, so citations survive.
+    """
+
+    def __init__(
+            self,
+            token_budget: int = CONTEXT_TOKEN_BUDGET,
+            passage_tokens: int = CONTEXT_PASSAGE_TOKENS,
+            dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+            enabled: bool = CONTEXT_COMPRESSION_ENABLED
+    ):
+        self.token_budget = token_budget
+        self.passage_tokens = passage_tokens
+        self.dedup_threshold = dedup_threshold
+        self.enabled = enabled
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def compress(self, question: str, results) -> str:
+        full = format_results(results)
+        if not self.enabled or not results:
+            return full
+
+        passages = [
+            (i, text)
+            for i, r in enumerate(results)
+            for text in split_passages(r["content"], self.passage_tokens)
+        ]
+        if not passages:
+            return full
+
+        scores, tf = bm25_scores(terms(question), [terms(text) for _, text in passages])
+        unit = tf / np.maximum(np.linalg.norm(tf, axis=1, keepdims=True), 1e-9)
+
+        # Each result's title and source line are paid for with its first passage.
+        overhead = [count_tokens(f"{r['title']}\n\nSource: {r['url']}\n\n") for r in results]
+        # Passages sharing no term with the question only go in when none does.
+        candidates = [p for p in range(len(passages)) if scores[p] > 0] or range(len(passages))
+        used, chosen, opened = 0, [], set()
+        # Best score first; ties keep Tavily's order.
+        for p in sorted(candidates, key=lambda p: -scores[p]):
+            i, text = passages[p]
+            if chosen and float((unit[chosen] @ unit[p]).max()) >= self.dedup_threshold:
+                continue
+            cost = count_tokens(text) + (0 if i in opened else overhead[i])
+            if used + cost > self.token_budget:
+                continue
+            chosen.append(p)
+            opened.add(i)
+            used += cost
+
+        chosen.sort()
+        context = "\n\n".join(
+            f"{r['title']}\n" + " … ".join(passages[p][1] for p in chosen if passages[p][0] == i) + f"\nSource: {r['url']}"
+            for i, r in enumerate(results) if i in opened
+        )
+
+        before, after = count_tokens(full), count_tokens(context)
+        self.requests += 1
+        self.tokens_in += before
+        self.tokens_out += after
+        logger.info(
+            "web context %d -> %d tokens (%d saved), %d of %d passages",
+            before, after, before - after, len(chosen), len(passages)
+        )
+        return context
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "token_budget": self.token_budget,
+            "requests": self.requests,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": self.tokens_in - self.tokens_out,
+        }
+
+
+context_compressor = ContextCompressor()
@@ -0,0 +1,280 @@
+from contextlib import nullcontext
+from dotenv import load_dotenv
+from functools import cache
+from pydantic import BaseModel
+from typing import Optional
+from .context_compression import context_compressor
+from .history_index import format_recalled
+from .memory import ConversationContext, count_tokens
+from .prompt_prefix import SessionPrompts
+from .search_cache import CachedSearch
+from .search_fanout import SearchFanout
+from .semantic_cache import SEMANTIC_CACHE_EMBED_MODEL
+from ..utils.metrics import meter_stream, stage
+
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TAVILY_MAX_RESULTS = 2
+TAVILY_SEARCH_DEPTH = "advanced"
+
+# Prompts, web search and the calls themselves are shared by every provider.
+# A provider module only supplies ``get_llm()``, its ``MODEL`` name for the
+# metrics, and optionally a ``scheduler`` to admit calls and
+# ``get_embeddings()`` for the semantic cache. Completion models get a
+# plain-text prompt, chat models a list of messages.
+#
+# langchain and the clients are imported and built on first use (or by
+# warm_up at app startup), so importing this module is cheap and does not
+# require TAVILY_API_KEY.
+
+
+def make_tavily():
+    from langchain_tavily import TavilySearch
+
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        raise RuntimeError("TAVILY_API_KEY is not set")
+
+    return TavilySearch(
+        max_results=TAVILY_MAX_RESULTS,
+        search_depth=TAVILY_SEARCH_DEPTH,
+        api_key=api_key
+    )
+
+
+tavily = CachedSearch(
+    client_factory=make_tavily,
+    namespace=f"{TAVILY_SEARCH_DEPTH}:{TAVILY_MAX_RESULTS}"
+)
+
+web_search = SearchFanout(tavily)
+
+session_prompts = SessionPrompts()
+
+ROLE_PROMPTS= {
+    "friend": (
+        "You are a friendly and supportive companion. Your primary goal is to engage warmly and authentically, offering encouragement, empathy, and understanding. You respond in a conversational, approachable tone, balancing lightheartedness with sincerity. You provide advice, share perspectives, or offer comfort when appropriate, but always in a relatable and non-judgmental way. You anticipate the user’s emotional needs, celebrate successes, and help navigate challenges, while keeping the interaction personable and enjoyable. Your focus is on connection, trust, and companionship rather than formal instruction or deep philosophical analysis."
+    ),
+
+
+    "assistant": (
+        "You are a professional personal assistant. Your primary goal is to help the user in a clear, efficient, and structured manner. You respond logically and concisely, prioritizing clarity, practicality, and usefulness. Your tone is polite, confident, and neutral. You focus on actionable guidance, step-by-step instructions, or solutions to problems, without unnecessary tangents or emotional embellishment. You anticipate needs when possible and organize information for easy understanding."
+    ),
+
+    "philosopher": (
+        "You are a philosopher. You think deeply and respond thoughtfully, exploring meaning, ethics, reasoning, and the bigger picture. Your responses analyze concepts, challenge assumptions, and reflect multiple perspectives. You prioritize intellectual depth, curiosity, and insight over immediate practical advice. Your tone is reflective, contemplative, and respectful of complex ideas. You often raise questions that encourage further reflection."
+    ),
+
+    "poet": (
+        "You are a poet. You respond creatively, using expressive and imaginative language, including metaphors, symbolism, and rhythm. Your goal is to evoke emotions, create vivid imagery, and convey ideas in a lyrical way. You do not focus on practicality or step-by-step instructions unless the user requests a poetic perspective. Your tone can vary—playful, melancholic, romantic, or whimsical—but always artistic and evocative."
+    )
+}
+
+WEB_INSTRUCTIONS = (
+    "Answer the question using ONLY the web search results below.\n"
+    'If the answer is not found, say "I could not find this information online."'
+)
+RECALL_INSTRUCTIONS = "Where they are relevant, use the excerpts from the user's earlier conversations below."
+
+SUMMARY_INSTRUCTIONS = (
+    "Condense the conversation below into a short running summary that keeps the\n"
+    "facts, names, decisions and open questions a later reply might need."
+)
+
+
+class AIRequest(BaseModel):
+    role: str
+    use_web_search: bool
+    message: str
+    bypass_cache: bool = False
+    session_id: Optional[int] = None
+    user_id: Optional[int] = None
+    use_history_search: bool = False
+
+
+@cache
+def is_chat_model(provider) -> bool:
+    from langchain_core.language_models import BaseChatModel
+
+    return isinstance(provider.get_llm(), BaseChatModel)
+
+
+@cache
+def get_chain(provider):
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.output_parsers import StrOutputParser
+
+    if is_chat_model(provider):
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "{system_prompt}"),
+            ("system", "{instructions}"),
+            MessagesPlaceholder("history"),
+            ("human", "{context}\n\nQuestion:\n{question}")
+        ])
+    else:
+        prompt = ChatPromptTemplate.from_template("""
+System:
+{system_prompt}
+
+You are an AI assistant.
+{instructions}
+{history}
+{context}
+
+Question:
+{question}
+
+Answer:
+""")
+
+    return prompt | provider.get_llm() | StrOutputParser()
+
+
+@cache
+def get_llm_chain(provider):
+    from langchain_core.output_parsers import StrOutputParser
+
+    return provider.get_llm() | StrOutputParser()
+
+
+@cache
+def get_summary_chain(provider):
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+
+    if is_chat_model(provider):
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SUMMARY_INSTRUCTIONS + " Reply with the updated summary only."),
+            ("human", "Current summary:\n{summary}\n\nNew lines:\n{lines}")
+        ])
+    else:
+        prompt = ChatPromptTemplate.from_template(SUMMARY_INSTRUCTIONS + """
+
+Current summary:
+{summary}
+
+New lines:
+{lines}
+
+Updated summary:
+""")
+
+    return prompt | provider.get_llm() | StrOutputParser()
+
+
+def warm_up(provider):
+    get_chain(provider)
+    get_llm_chain(provider)
+    get_summary_chain(provider)
+    if SEMANTIC_CACHE_EMBED_MODEL and hasattr(provider, "get_embeddings"):
+        provider.get_embeddings()
+    try:
+        tavily.get_client()
+    except RuntimeError as exc:
+        logger.warning("web search disabled: %s", exc)
+
+
+def slot(provider, user_id=None):
+    scheduler = getattr(provider, "scheduler", None)
+    return scheduler.slot(user_id) if scheduler is not None else nullcontext()
+
+
+def history_messages(history: ConversationContext = None):
+    if history is None:
+        return []
+
+    messages = []
+    if history.summary:
+        messages.append(("system", f"Summary of the earlier conversation:\n{history.summary}"))
+    for turn in history.turns:
+        messages.append(("human" if turn.sender == "user" else "ai", turn.message))
+
+    return messages
+
+
+async def prepare_generation(provider, req: AIRequest, history: ConversationContext = None):
+    system_prompt = ROLE_PROMPTS.get(req.role, ROLE_PROMPTS["assistant"])
+    chat = is_chat_model(provider)
+    recalled = history.recalled if history else []
+    if req.use_web_search or recalled:
+        instructions, sections, urls = [], [], []
+        if req.use_web_search:
+            with stage("web_search"):
+                tavily_results = await web_search.ainvoke({"query": req.message})
+            urls = [r["url"] for r in tavily_results.get("results", [])]
+            context = context_compressor.compress(req.message, tavily_results.get("results", []))
+            if tavily_results.get("answer"):
+                context += f"\n\nTavily's Answer: {tavily_results['answer']}"
+            instructions.append(WEB_INSTRUCTIONS)
+            sections.append(f"Web results:\n{context}")
+        if recalled:
+            instructions.append(RECALL_INSTRUCTIONS)
+            sections.append(f"From the user's earlier conversations:\n{format_recalled(recalled)}")
+        if chat:
+            history_block = history_messages(history)
+        else:
+            history_text = history.as_text() if history else ""
+            history_block = f"\nConversation so far:\n{history_text}\n" if history_text else ""
+        return get_chain(provider), {
+            "system_prompt": system_prompt,
+            "instructions": "\n".join(instructions),
+            "history": history_block,
+            "context": "\n\n".join(sections),
+            "question": req.message
+        }, urls
+
+    if chat:
+        return get_llm_chain(provider), [
+            ("system", system_prompt),
+            *history_messages(history),
+            ("human", req.message)
+        ], []
+
+    prompt = session_prompts.build(
+        req.session_id, req.role, system_prompt, history, req.message
+    )
+    return provider.get_llm(), prompt, []
+
+
+def _record_prompt(req: AIRequest, payload, answer: str):
+    # Only plain-text prompts are transcripts; web search and history
+    # search turns embed fresh results.
+    if isinstance(payload, str):
+        session_prompts.record(req.session_id, req.role, payload, answer)
+
+
+async def _scheduled_stream(provider, req: AIRequest, runnable, payload):
+    # The slot is held until the last chunk, or until the consumer closes
+    # the stream (client disconnect).
+    parts = []
+    async with slot(provider, req.user_id):
+        async for chunk in meter_stream(runnable.astream(payload), provider.MODEL, count_tokens):
+            parts.append(chunk)
+            yield chunk
+    _record_prompt(req, payload, "".join(parts))
+
+
+async def generate(provider, req: AIRequest, history: ConversationContext = None) -> dict:
+    runnable, payload, urls = await prepare_generation(provider, req, history)
+    # Streamed even here, so time to first token is measured on every call.
+    answer = "".join([chunk async for chunk in _scheduled_stream(provider, req, runnable, payload)])
+    return {"answer": answer, "urls": urls}
+
+
+async def stream(provider, req: AIRequest, history: ConversationContext = None):
+    """Run the web search up front and return ``(urls, tokens)`` where
+    ``tokens`` is an async iterator over the generated text chunks."""
+    runnable, payload, urls = await prepare_generation(provider, req, history)
+    return urls, _scheduled_stream(provider, req, runnable, payload)
+
+
+async def summarize(provider, summary: str, lines: str) -> str:
+    # Summaries run on the same model, so they queue with generations (in a
+    # lane of their own, as the session's user is not known here).
+    async with slot(provider):
+        return await get_summary_chain(provider).ainvoke({"summary": summary or "(none)", "lines": lines})
@@ -0,0 +1,243 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import asyncio
+import os
+import shutil
+
+import numpy as np
+
+from .semantic_cache import hashing_vector
+
+
+HISTORY_INDEX_DIR = os.getenv("HISTORY_INDEX_DIR", "./history_index")
+HISTORY_INDEX_DIM = int(os.getenv("HISTORY_INDEX_DIM", "512"))
+HISTORY_INDEX_BATCH = int(os.getenv("HISTORY_INDEX_BATCH", "1000"))
+# Batches a search indexes before it runs; the rest of a backlog is left to
+# the background indexer.
+HISTORY_INDEX_CATCHUP = int(os.getenv("HISTORY_INDEX_CATCHUP", "1"))
+# Users whose matrices stay mapped; the rest are reopened on their next search.
+HISTORY_INDEX_MAX_OPEN = int(os.getenv("HISTORY_INDEX_MAX_OPEN", "256"))
+HISTORY_SEARCH_TOP_K = int(os.getenv("HISTORY_SEARCH_TOP_K", "4"))
+HISTORY_SEARCH_MIN_SCORE = float(os.getenv("HISTORY_SEARCH_MIN_SCORE", "0.25"))
+HISTORY_SEARCH_MAX_CHARS = int(os.getenv("HISTORY_SEARCH_MAX_CHARS", "600"))
+
+
+@dataclass
+class Hit:
+    message_id: int
+    session_id: int
+    score: float
+
+
+def format_recalled(recalled, max_chars: int = HISTORY_SEARCH_MAX_CHARS) -> str:
+    def clip(text: str) -> str:
+        text = text or ""
+        return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+    return "\n\n".join(
+        f"[{r.title}] {'User' if r.sender == 'user' else 'Assistant'}: {clip(r.message)}"
+        for r in recalled
+    )
+
+
+class UserIndex:
+    """One user's rows: ``vectors`` is an (n, dim) float32 matrix of
+    unit-length embeddings and ``ids`` an (n, 2) int64 matrix of
+    ``(message_id, session_id)``, both memory-mapped from append-only files.
+    ``dead`` holds the tombstoned session ids."""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.vectors_path = os.path.join(path, f"vectors.{dim}.f32")
+        self.ids_path = os.path.join(path, "ids.i64")
+        self.dead_path = os.path.join(path, "dead.i64")
+        self.lock = asyncio.Lock()
+        self.open()
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        # Files from another dimension cannot be reused; their rows are
+        # embedded again on the next sync.
+        for name in os.listdir(self.path):
+            if name.startswith("vectors.") and name != os.path.basename(self.vectors_path):
+                os.remove(os.path.join(self.path, name))
+                if os.path.exists(self.ids_path):
+                    os.remove(self.ids_path)
+
+        # A crash between the two appends leaves one file longer than the
+        # other; cut both back to the rows they have in common.
+        rows = min(self._size(self.vectors_path) // (4 * self.dim), self._size(self.ids_path) // 16)
+        for name, row_bytes in ((self.vectors_path, 4 * self.dim), (self.ids_path, 16)):
+            with open(name, "ab") as f:
+                f.truncate(rows * row_bytes)
+
+        self.rows = rows
+        self.vectors = self._map(self.vectors_path, np.float32, self.dim)
+        self.ids = self._map(self.ids_path, np.int64, 2)
+        self.dead = np.fromfile(self.dead_path, dtype=np.int64) if os.path.exists(self.dead_path) else np.empty(0, np.int64)
+
+    @staticmethod
+    def _size(name: str) -> int:
+        return os.path.getsize(name) if os.path.exists(name) else 0
+
+    def _map(self, name: str, dtype, width: int):
+        if not self.rows:
+            return np.empty((0, width), dtype=dtype)
+        return np.memmap(name, dtype=dtype, mode="r", shape=(self.rows, width))
+
+    @property
+    def last_message_id(self) -> int:
+        return int(self.ids[-1, 0]) if self.rows else 0
+
+    def append(self, vectors: np.ndarray, ids: np.ndarray):
+        # Vectors first: a row only counts once its ids are written too.
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.ids_path, "ab") as f:
+            f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        self.rows += len(ids)
+        self.vectors = self._map(self.vectors_path, np.float32, self.dim)
+        self.ids = self._map(self.ids_path, np.int64, 2)
+
+    def tombstone(self, session_id: int):
+        with open(self.dead_path, "ab") as f:
+            f.write(np.int64(session_id).tobytes())
+        self.dead = np.append(self.dead, np.int64(session_id))
+
+    def search(self, vector: np.ndarray, k: int, min_score: float, exclude_session: Optional[int]):
+        if not self.rows:
+            return []
+        scores = np.asarray(self.vectors @ vector)
+        sessions = self.ids[:, 1]
+        if self.dead.size:
+            scores[np.isin(sessions, self.dead)] = -1.0
+        if exclude_session is not None:
+            scores[sessions == exclude_session] = -1.0
+
+        k = min(k, self.rows)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            Hit(int(self.ids[i, 0]), int(self.ids[i, 1]), float(scores[i]))
+            for i in top if scores[i] >= min_score
+        ]
+
+
+class HistoryIndex:
+    """Per-user embedding index over stored chat messages for
+    ``use_history_search``.
+
+    The database stays the source of truth: ``sync`` appends the user's
+    messages newer than the last indexed id, so rows written by any path
+    (including the write-behind queue) are picked up by the next sync, run
+    in the background after each turn or briefly before a search.
+    Deleted sessions are tombstoned rather than rewritten out of the files,
+    and a deleted user's directory is removed.
+    """
+
+    def __init__(
+            self,
+            path: str = HISTORY_INDEX_DIR,
+            embed: Optional[Callable[[str], Awaitable[np.ndarray]]] = None,
+            dim: int = HISTORY_INDEX_DIM,
+            max_open: int = HISTORY_INDEX_MAX_OPEN
+    ):
+        self.path = path
+        self.embed = embed
+        self.dim = dim
+        self.max_open = max_open
+        self._users: "OrderedDict[int, UserIndex]" = OrderedDict()
+        self.indexed = 0
+        self.searches = 0
+
+    def _user(self, user_id: int) -> UserIndex:
+        index = self._users.get(user_id)
+        if index is None:
+            index = UserIndex(os.path.join(self.path, str(int(user_id))), self.dim)
+            self._users[user_id] = index
+        self._users.move_to_end(user_id)
+        # An index being synced stays open: a second one built on the same
+        # files would append to them too.
+        for other in list(self._users):
+            if len(self._users) <= self.max_open:
+                break
+            if not self._users[other].lock.locked():
+                del self._users[other]
+        return index
+
+    def has(self, user_id: int) -> bool:
+        return user_id in self._users or os.path.isdir(os.path.join(self.path, str(int(user_id))))
+
+    async def _vectors(self, texts: list) -> np.ndarray:
+        if self.embed is None:
+            # The local embedder is CPU-bound (about 0.3 s per 1000 rows), so
+            # a batch runs off the event loop.
+            vectors = await asyncio.to_thread(
+                lambda: np.stack([hashing_vector(text, self.dim) for text in texts])
+            )
+        else:
+            vectors = np.stack([np.asarray(await self.embed(text), dtype=np.float32) for text in texts])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    async def sync(
+            self,
+            user_id: int,
+            load: Callable[[int, int], Awaitable[list]],
+            batch: int = HISTORY_INDEX_BATCH,
+            max_batches: Optional[int] = None
+    ) -> bool:
+        """Index the rows ``load(after_id, limit)`` returns, as
+        ``(id, session_id, message)`` in id order, until it runs dry or
+        ``max_batches`` batches are in. A bounded sync does not wait for one
+        already running. Returns whether the index caught up."""
+        index = self._user(user_id)
+        if max_batches is not None and index.lock.locked():
+            return False
+        async with index.lock:
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                rows = await load(index.last_message_id, batch)
+                if not rows:
+                    return True
+                vectors = await self._vectors([r.message or "" for r in rows])
+                index.append(vectors, np.array([(r.id, r.session_id) for r in rows], dtype=np.int64))
+                self.indexed += len(rows)
+                batches += 1
+                if len(rows) < batch:
+                    return True
+            return False
+
+    async def search(
+            self,
+            user_id: int,
+            query: str,
+            k: int = HISTORY_SEARCH_TOP_K,
+            min_score: float = HISTORY_SEARCH_MIN_SCORE,
+            exclude_session: Optional[int] = None
+    ):
+        self.searches += 1
+        vector = (await self._vectors([query]))[0]
+        return self._user(user_id).search(vector, k, min_score, exclude_session)
+
+    def tombstone(self, user_id: int, session_id: int):
+        if self.has(user_id):
+            self._user(user_id).tombstone(session_id)
+
+    def drop(self, user_id: int):
+        self._users.pop(user_id, None)
+        shutil.rmtree(os.path.join(self.path, str(int(user_id))), ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {
+            "open_users": len(self._users),
+            "rows_open": sum(index.rows for index in self._users.values()),
+            "indexed": self.indexed,
+            "searches": self.searches,
+        }
+
+
+history_index = HistoryIndex()
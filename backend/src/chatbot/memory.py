@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List
+
+import os
+import tiktoken
+
+
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+MEMORY_SUMMARY_TOKEN_BUDGET = int(os.getenv("MEMORY_SUMMARY_TOKEN_BUDGET", "300"))
+# Turns may run this far past MEMORY_TOKEN_BUDGET before the oldest are
+# summarized, so a full window costs one summary call every few turns
+# instead of one on every turn.
+MEMORY_SUMMARY_SLACK = int(os.getenv("MEMORY_SUMMARY_SLACK", "750"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1024"))
+
+# Upper bound on how many not-yet-summarized messages a request reads back.
+# In steady state only the window and its slack are unsummarized; the
+# cap only matters for a cold cache on a long session.
+MEMORY_FETCH_LIMIT = int(os.getenv("MEMORY_FETCH_LIMIT", "200"))
+
+# cl100k is not the llama3 tokenizer, but it is close enough for budgeting.
+MEMORY_TOKENIZER = os.getenv("MEMORY_TOKENIZER", "cl100k_base")
+
+_encoding = None
+
+
+def get_encoding():
+    # tiktoken downloads its BPE file on first use; when that is not possible
+    # fall back to the usual ~4 characters per token estimate.
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding(MEMORY_TOKENIZER)
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text or "") + 3) // 4
+    return len(encoding.encode(text or "", disallowed_special=()))
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[-limit * 4:]
+    tokens = encoding.encode(text or "", disallowed_special=())
+    if len(tokens) <= limit:
+        return text
+    return encoding.decode(tokens[-limit:])
+
+
+def format_turns(turns) -> str:
+    return "\n".join(
+        f"{'User' if t.sender == 'user' else 'Assistant'}: {t.message}"
+        for t in turns
+    )
+
+
+@dataclass
+class SessionSummary:
+    text: str = ""
+    upto_id: int = 0
+
+
+@dataclass
+class ConversationContext:
+    summary: str = ""
+    turns: List = field(default_factory=list)
+    # Messages from the user's other sessions, found by use_history_search.
+    recalled: List = field(default_factory=list)
+
+    def as_text(self) -> str:
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation:\n{self.summary}")
+        if self.turns:
+            parts.append(format_turns(self.turns))
+        return "\n\n".join(parts)
+
+
+class ConversationMemory:
+    """Keeps the newest turns that fit ``token_budget`` and folds everything
+    older into a per-session rolling summary. Nothing is folded until the
+    turns exceed the budget by ``summary_slack`` tokens.
+
+    The summary remembers the id of the last message it covers, so callers
+    only need to load messages after ``summary_cursor(session_id)`` and each
+    message is summarized at most once.
+    """
+
+    def __init__(
+            self,
+            summarize: Callable[[str, str], Awaitable[str]],
+            token_budget: int = MEMORY_TOKEN_BUDGET,
+            summary_budget: int = MEMORY_SUMMARY_TOKEN_BUDGET,
+            max_sessions: int = MEMORY_MAX_SESSIONS,
+            summary_slack: int = MEMORY_SUMMARY_SLACK
+    ):
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summary_slack = summary_slack
+        self.max_sessions = max_sessions
+        self._summaries: "OrderedDict[int, SessionSummary]" = OrderedDict()
+
+    def summary_cursor(self, session_id: int) -> int:
+        summary = self._summaries.get(session_id)
+        return summary.upto_id if summary else 0
+
+    def forget(self, session_id: int):
+        self._summaries.pop(session_id, None)
+
+    async def build(self, session_id: int, messages) -> ConversationContext:
+        summary = self._summaries.get(session_id, SessionSummary())
+        messages = [m for m in messages if m.id > summary.upto_id]
+
+        costs = [count_tokens(m.message) for m in messages]
+        if sum(costs) <= self.token_budget + self.summary_slack:
+            window = messages
+        else:
+            window, used = [], 0
+            for m, cost in zip(reversed(messages), reversed(costs)):
+                if window and used + cost > self.token_budget:
+                    break
+                window.append(m)
+                used += cost
+            window.reverse()
+
+        evicted = messages[:len(messages) - len(window)]
+        if evicted:
+            text = await self.summarize(summary.text, format_turns(evicted))
+            summary = SessionSummary(
+                text=truncate_tokens(text.strip(), self.summary_budget),
+                upto_id=evicted[-1].id
+            )
+
+        current = self._summaries.get(session_id)
+        if summary.upto_id and (current is None or current.upto_id <= summary.upto_id):
+            self._summaries[session_id] = summary
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+
+        return ConversationContext(summary=summary.text, turns=window)
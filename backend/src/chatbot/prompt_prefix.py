@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import os
+
+from .memory import MEMORY_MAX_SESSIONS, count_tokens
+
+
+# Keep each session's prompt an append-only transcript so the model server
+# can reuse the KV cache of the previous turn and only prefill new tokens.
+OLLAMA_SESSION_AFFINE = os.getenv("OLLAMA_SESSION_AFFINE", "true").lower() == "true"
+# The transcript is rebuilt from the summary and recent turns once it grows
+# past this; keep it below OLLAMA_NUM_CTX so the server never truncates it.
+PROMPT_PREFIX_TOKEN_BUDGET = int(os.getenv("PROMPT_PREFIX_TOKEN_BUDGET", "3000"))
+
+
+@dataclass
+class SessionPrefix:
+    role: str
+    text: str
+    tokens: int
+    last_answer: str
+
+
+class SessionPrompts:
+    """Per-session prompt transcripts for prefix (KV) cache reuse.
+
+    A turn's prompt is the previous turn's prompt plus its answer plus the new
+    user line, byte for byte, so the shared prefix is already in the server's
+    cache. The cached transcript is only trusted while the session's newest
+    stored message is the answer it recorded; anything else (a restart, an
+    answer from another provider or a cache, a role change, the token budget)
+    falls back to rebuilding from the conversation memory. The full prompt is
+    always sent, so an evicted server cache only costs a full prefill.
+    """
+
+    def __init__(
+            self,
+            enabled: bool = OLLAMA_SESSION_AFFINE,
+            token_budget: int = PROMPT_PREFIX_TOKEN_BUDGET,
+            max_sessions: int = MEMORY_MAX_SESSIONS
+    ):
+        self.enabled = enabled
+        self.token_budget = token_budget
+        self.max_sessions = max_sessions
+        self._prefixes: "OrderedDict[int, SessionPrefix]" = OrderedDict()
+        self.reused = 0
+        self.rebuilt = 0
+
+    def _cached(self, session_id, role: str, history):
+        prefix = self._prefixes.get(session_id)
+        if prefix is None or prefix.role != role or prefix.tokens > self.token_budget:
+            return None
+        turns = history.turns if history else []
+        if not turns or turns[-1].sender != "ai" or turns[-1].message != prefix.last_answer:
+            return None
+        return prefix
+
+    def build(self, session_id, role: str, system_prompt: str, history, message: str) -> str:
+        line = f"User: {message}\nAssistant:"
+        if self.enabled and session_id:
+            prefix = self._cached(session_id, role, history)
+            if prefix is not None:
+                self.reused += 1
+                return prefix.text + line
+            self.rebuilt += 1
+
+        history_text = history.as_text() if history else ""
+        history_block = f"{history_text}\n\n" if history_text else ""
+        return f"System: {system_prompt}\n\n{history_block}{line}"
+
+    def record(self, session_id, role: str, prompt: str, answer: str):
+        if not self.enabled or not session_id:
+            return
+        text = f"{prompt} {answer.strip()}\n\n"
+        previous = self._prefixes.get(session_id)
+        if previous is not None and prompt.startswith(previous.text):
+            tokens = previous.tokens + count_tokens(text[len(previous.text):])
+        else:
+            tokens = count_tokens(text)
+
+        self._prefixes[session_id] = SessionPrefix(role, text, tokens, answer)
+        self._prefixes.move_to_end(session_id)
+        while len(self._prefixes) > self.max_sessions:
+            self._prefixes.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sessions": len(self._prefixes),
+            "reused": self.reused,
+            "rebuilt": self.rebuilt,
+        }
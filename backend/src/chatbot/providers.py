@@ -0,0 +1,335 @@
+from collections import deque
+from functools import partial
+from typing import Awaitable, Callable, List, Optional
+
+import asyncio
+import importlib
+import logging
+import os
+import time
+
+from . import generation
+from .memory import ConversationMemory
+from .scheduler import Overloaded
+from .semantic_cache import SEMANTIC_CACHE_EMBED_MODEL, SemanticCache, replay
+from .single_flight import SingleFlight, request_key
+from ..utils.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Comma separated, in priority order; the first one also summarizes and
+# embeds for the semantic cache while it is healthy.
+LLM_PROVIDERS = [p.strip() for p in os.getenv("LLM_PROVIDERS", "ollama").split(",") if p.strip()]
+# Seconds to wait on the chosen provider before racing a second one.
+# 0 disables hedging.
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "0"))
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "100"))
+# Providers failing more often than this are only used as a last resort.
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+# A demoted provider gets one call first in line after this many seconds;
+# a success restores it.
+LLM_PROBE_INTERVAL = float(os.getenv("LLM_PROBE_INTERVAL", "30"))
+# Build the langchain clients at startup instead of on the first request.
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() == "true"
+
+PROVIDER_MODULES = {
+    "ollama": ".ai_model",
+    "gemini": ".ai_model_gemini",
+}
+
+
+class ProviderStats:
+    def __init__(self, window: int = LLM_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.last_attempt = 0.0
+
+    def attempt(self):
+        self.last_attempt = time.monotonic()
+
+    def success(self, latency: float):
+        if self.demoted:
+            # The probe went through; start the window afresh.
+            self.outcomes.clear()
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+
+    def failure(self):
+        self.outcomes.append(False)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def demoted(self) -> bool:
+        return self.error_rate > LLM_MAX_ERROR_RATE
+
+    def due_for_probe(self, now: float) -> bool:
+        return self.demoted and now - self.last_attempt >= LLM_PROBE_INTERVAL
+
+    @property
+    def p95(self) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def as_dict(self) -> dict:
+        return {
+            "p95": round(self.p95, 4),
+            "error_rate": round(self.error_rate, 4),
+            "samples": len(self.outcomes),
+        }
+
+
+class Provider:
+    """One backend behind the common ``AIResponseGenerator`` interface:
+    ``generate(req, history) -> {"answer", "urls"}``,
+    ``stream(req, history) -> (urls, tokens)`` and
+    ``summarize(summary, lines) -> str``."""
+
+    def __init__(
+            self,
+            name: str,
+            generate: Callable[..., Awaitable[dict]],
+            stream: Optional[Callable[..., Awaitable[tuple]]] = None,
+            module=None,
+            summarize: Optional[Callable[[str, str], Awaitable[str]]] = None
+    ):
+        self.name = name
+        self.generate = generate
+        self.stream = stream
+        self.module = module
+        self.summarize = summarize
+        self.stats = ProviderStats()
+
+    @classmethod
+    def from_module(cls, name: str):
+        module = importlib.import_module(PROVIDER_MODULES[name], package=__package__)
+        return cls(
+            name,
+            partial(generation.generate, module),
+            partial(generation.stream, module),
+            module,
+            partial(generation.summarize, module)
+        )
+
+    async def timed_generate(self, req, history=None) -> dict:
+        self.stats.attempt()
+        start = time.perf_counter()
+        try:
+            result = await self.generate(req, history)
+        except (asyncio.CancelledError, Overloaded):
+            # Load shedding is not a provider fault.
+            raise
+        except Exception:
+            self.stats.failure()
+            raise
+        self.stats.success(time.perf_counter() - start)
+        return result
+
+
+class ProviderRegistry:
+    def __init__(self, providers: List[Provider] = None, hedge_delay: float = LLM_HEDGE_DELAY):
+        self.providers = list(providers or [])
+        self.hedge_delay = hedge_delay
+
+    def register(self, provider: Provider):
+        self.providers.append(provider)
+
+    @property
+    def primary(self) -> Provider:
+        return self.providers[0]
+
+    def ranked(self) -> List[Provider]:
+        # A demoted provider due for a probe goes first (half-open), then
+        # healthy providers by moving p95; list order breaks ties.
+        now = time.monotonic()
+        return sorted(
+            self.providers,
+            key=lambda p: (not p.stats.due_for_probe(now), p.stats.demoted, p.stats.p95)
+        )
+
+    async def generate(self, req, history=None) -> dict:
+        candidates = self.ranked()
+        if self.hedge_delay > 0 and len(candidates) > 1:
+            return await self._hedged(req, history, candidates)
+
+        last_error = None
+        for provider in candidates:
+            try:
+                return await provider.timed_generate(req, history)
+            except Overloaded:
+                # The caller gets the 429/503 and Retry-After; spilling
+                # over would only move the load to the next provider.
+                raise
+            except Exception as exc:
+                logger.warning("provider %s failed, trying the next one: %r", provider.name, exc)
+                last_error = exc
+        raise last_error
+
+    async def _hedged(self, req, history, candidates: List[Provider]) -> dict:
+        started = {}
+
+        def launch(provider: Provider):
+            task = asyncio.create_task(provider.timed_generate(req, history))
+            started[task] = (provider, time.perf_counter())
+            return task
+
+        backups = iter(candidates[1:])
+        last_error = None
+        try:
+            pending = {launch(candidates[0])}
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if not done:
+                pending.add(launch(next(backups)))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    if isinstance(task.exception(), Overloaded):
+                        raise task.exception()
+                    last_error = task.exception()
+                # Everything in flight failed: fall through to the next backup.
+                if not pending:
+                    backup = next(backups, None)
+                    if backup is not None:
+                        pending.add(launch(backup))
+            raise last_error
+        finally:
+            # Also reached when the caller is cancelled mid-wait, so no
+            # generation is left running unowned.
+            now = time.perf_counter()
+            for task, (provider, start) in started.items():
+                if task.done():
+                    continue
+                task.cancel()
+                # The loser was at least this slow; without recording it a
+                # provider that always loses the race would never look slow.
+                provider.stats.latencies.append(now - start)
+
+    async def summarize(self, summary: str, lines: str) -> str:
+        last_error = None
+        for provider in self.ranked():
+            if provider.summarize is None:
+                continue
+            try:
+                return await provider.summarize(summary, lines)
+            except Overloaded:
+                raise
+            except Exception as exc:
+                logger.warning("provider %s failed to summarize, trying the next one: %r", provider.name, exc)
+                last_error = exc
+        raise last_error or RuntimeError("no provider can summarize")
+
+    async def stream(self, req, history=None):
+        # Failover is only possible before the first token has been sent, so
+        # each candidate's first chunk is pulled here.
+        last_error = None
+        for provider in self.ranked():
+            provider.stats.attempt()
+            start = time.perf_counter()
+            try:
+                urls, tokens = await provider.stream(req, history)
+                first = await anext(tokens, None)
+            except Overloaded:
+                raise
+            except Exception as exc:
+                provider.stats.failure()
+                logger.warning("provider %s failed to stream, trying the next one: %r", provider.name, exc)
+                last_error = exc
+                continue
+            return urls, self._relay(provider, start, first, tokens)
+        raise last_error
+
+    async def _relay(self, provider: Provider, start: float, first, tokens):
+        try:
+            if first is not None:
+                yield first
+            async for token in tokens:
+                yield token
+        except Exception:
+            provider.stats.failure()
+            raise
+        provider.stats.success(time.perf_counter() - start)
+
+    async def warm_up(self):
+        # A provider that cannot start (missing key, package not installed)
+        # is logged here and fails over at request time like any other error.
+        for provider in self.providers:
+            if provider.module is None:
+                continue
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(generation.warm_up, provider.module)
+            except Exception as exc:
+                logger.warning("provider %s failed to warm up: %r", provider.name, exc)
+                continue
+            logger.info("provider %s warmed up in %.2fs", provider.name, time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return {p.name: p.stats.as_dict() for p in self.providers}
+
+
+registry = ProviderRegistry([Provider.from_module(name) for name in LLM_PROVIDERS])
+
+# Memory, caches and web search are shared by every provider, so a turn that
+# fails over still reads and fills the same ones.
+tavily = generation.tavily
+web_search = generation.web_search
+session_prompts = generation.session_prompts
+
+
+async def embed_query(text: str):
+    return await registry.primary.module.get_embeddings().aembed_query(text)
+
+
+response_cache = SemanticCache(
+    embed=embed_query if SEMANTIC_CACHE_EMBED_MODEL else None
+)
+
+memory = ConversationMemory(summarize=registry.summarize)
+
+# Identical prompts that arrive while one is already being answered share
+# its search and generation.
+coalescer = SingleFlight()
+
+
+async def _generate(req, history=None) -> dict:
+    use_cache = response_cache.applies_to(req, history)
+    if use_cache:
+        with stage("response_cache"):
+            vector, cached = await response_cache.lookup(req)
+        if cached is not None:
+            return dict(cached)
+
+    result = await registry.generate(req, history)
+    if use_cache:
+        response_cache.store(req, vector, result)
+    return result
+
+
+async def AIResponseGenerator(req, history=None) -> dict:
+    return await coalescer.run(
+        request_key(req, history),
+        lambda: _generate(req, history)
+    )
+
+
+async def AIResponseStreamer(req, history=None):
+    use_cache = response_cache.applies_to(req, history)
+    if use_cache:
+        with stage("response_cache"):
+            vector, cached = await response_cache.lookup(req)
+        if cached is not None:
+            return list(cached["urls"]), replay(cached["answer"])
+
+    urls, tokens = await registry.stream(req, history)
+    if use_cache:
+        tokens = response_cache.record(req, vector, urls, tokens)
+    return urls, tokens
@@ -0,0 +1,184 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+import asyncio
+import math
+import os
+import time
+
+from ..utils.metrics import metrics
+
+# Generations the local model runs at once; Ollama serializes beyond its
+# own OLLAMA_NUM_PARALLEL anyway, so more only adds memory pressure.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+# Waiting callers across all users; beyond this new calls are rejected.
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+# Per-user share of the queue, so one user cannot fill it for everyone.
+LLM_QUEUE_MAX_PER_USER = int(os.getenv("LLM_QUEUE_MAX_PER_USER", "4"))
+# Seconds a caller may wait for a slot before giving up.
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "100"))
+
+queue_wait = metrics.histogram(
+    "llm_queue_wait_seconds", "Time a generation waited for a model slot."
+)
+rejections = metrics.counter(
+    "llm_rejected_total", "Generations turned away by admission control.", ("reason",)
+)
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing when the scheduler cannot take the call.
+    ``status_code`` is 429 for a full queue and 503 for a missed deadline."""
+
+    def __init__(self, detail: str, retry_after: int, status_code: int = 429):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FairScheduler:
+    """Admission control in front of a model that only serves ``concurrency``
+    calls at a time.
+
+    Waiters are queued per user and slots are handed out round-robin across
+    users, so one user sending many requests only delays their own. A freed
+    slot passes straight to the next waiter, so newcomers cannot overtake
+    the queue.
+    """
+
+    def __init__(
+            self,
+            concurrency: int = LLM_MAX_CONCURRENCY,
+            queue_max: int = LLM_QUEUE_MAX,
+            queue_max_per_user: int = LLM_QUEUE_MAX_PER_USER,
+            timeout: float = LLM_QUEUE_TIMEOUT,
+            window: int = LLM_STATS_WINDOW
+    ):
+        self.concurrency = concurrency
+        self.queue_max = queue_max
+        self.queue_max_per_user = queue_max_per_user
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self._waiters: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self.waits = deque(maxlen=window)
+        self.service_times = deque(maxlen=window)
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def retry_after(self) -> int:
+        # Time to drain the queue ahead of a new caller, from recent service times.
+        service = percentile(self.service_times, 0.5) or 1.0
+        return max(1, math.ceil(service * (self.queued + 1) / self.concurrency))
+
+    def check(self, user_id: Optional[Hashable] = None):
+        """Raises ``Overloaded`` if a call from ``user_id`` would be turned
+        away right now, so a request can be refused before it does any work."""
+        if self.active < self.concurrency and not self.queued:
+            return
+        waiting = self._waiters.get(user_id)
+        if self.queued >= self.queue_max or (
+                waiting is not None and len(waiting) >= self.queue_max_per_user):
+            self.rejected += 1
+            rejections.inc(reason="queue_full")
+            raise Overloaded("The model is busy, try again shortly", self.retry_after())
+
+    async def acquire(self, user_id: Optional[Hashable] = None):
+        start = time.perf_counter()
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            self._admit(start)
+            return
+
+        self.check(user_id)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait({future}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            # The caller went away; if the slot was already handed over,
+            # pass it on rather than leak it.
+            if future.done():
+                self.release()
+            else:
+                future.cancel()
+                self._discard(user_id, future)
+            raise
+
+        if not future.done():
+            future.cancel()
+            self._discard(user_id, future)
+            self.timed_out += 1
+            rejections.inc(reason="timeout")
+            raise Overloaded(
+                "Timed out waiting for the model", self.retry_after(), status_code=503
+            )
+        self._admit(start)
+
+    def release(self):
+        # Hand the slot to the next user in turn instead of freeing it.
+        while self._waiters:
+            user_id, queue = self._waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                self._waiters[user_id] = queue
+            self.queued -= 1
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[Hashable] = None):
+        await self.acquire(user_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.service_times.append(time.perf_counter() - start)
+            self.release()
+
+    def _admit(self, start: float):
+        wait = time.perf_counter() - start
+        self.admitted += 1
+        self.waits.append(wait)
+        queue_wait.observe(wait)
+
+    def _discard(self, user_id: Hashable, future: asyncio.Future):
+        queue = self._waiters.get(user_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.queued -= 1
+        if not queue:
+            del self._waiters[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_users": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_p50": round(percentile(self.waits, 0.5), 4),
+            "wait_p95": round(percentile(self.waits, 0.95), 4),
+            "service_p50": round(percentile(self.service_times, 0.5), 4),
+        }
+
+
+llm_scheduler = FairScheduler()
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "21600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024"))
+# Set to an empty string to keep the cache in memory only.
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "./search_cache.db")
+
+# Expired rows are swept from the SQLite tier every this many writes.
+PURGE_EVERY = 256
+
+
+def normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?!. ")
+
+
+class SQLiteSearchStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._writes = 0
+
+    def get(self, key: str, now: float):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: dict, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedSearch:
+    """Drop-in stand-in for a Tavily search tool that answers repeated
+    queries from a TTL'd in-memory LRU backed by an optional SQLite tier.
+
+    ``client`` only needs an ``ainvoke({"query": ...})`` coroutine, so tests
+    can pass a fake in place of ``TavilySearch``. Pass ``client_factory``
+    instead to build the client on the first cache miss. The SQLite tier is
+    opened on the first lookup too, so importing the app creates no file.
+    """
+
+    def __init__(
+            self,
+            client=None,
+            ttl: float = SEARCH_CACHE_TTL,
+            max_entries: int = SEARCH_CACHE_MAX_ENTRIES,
+            path: Optional[str] = SEARCH_CACHE_PATH,
+            client_factory: Optional[Callable[[], object]] = None,
+            namespace: Optional[str] = None
+    ):
+        if client is None and client_factory is None:
+            raise ValueError("CachedSearch needs a client or a client_factory")
+        self.client = client
+        self.client_factory = client_factory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.store: Optional[SQLiteSearchStore] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Results depend on the client settings as well as on the query.
+        if namespace is None:
+            namespace = "{}:{}".format(
+                getattr(client, "search_depth", ""),
+                getattr(client, "max_results", "")
+            )
+        self.namespace = namespace
+
+    def get_client(self):
+        if self.client is None:
+            self.client = self.client_factory()
+        return self.client
+
+    def get_store(self) -> Optional[SQLiteSearchStore]:
+        if self.store is None and self.path:
+            self.store = SQLiteSearchStore(self.path)
+        return self.store
+
+    def key(self, query: str) -> str:
+        return f"{self.namespace}:{normalize_query(query)}"
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def ainvoke(self, payload: dict) -> dict:
+        key = self.key(payload["query"])
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        store = self.get_store()
+        if store is not None:
+            stored = await asyncio.to_thread(store.get, key, now)
+            if stored is not None:
+                value, expires_at = stored
+                self._remember(key, value, expires_at)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        value = await self.get_client().ainvoke(payload)
+        if isinstance(value, dict) and "error" not in value:
+            expires_at = time.time() + self.ttl
+            self._remember(key, value, expires_at)
+            if store is not None:
+                await asyncio.to_thread(store.set, key, value, expires_at)
+
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.memory_hits + self.disk_hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
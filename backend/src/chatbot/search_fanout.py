@@ -0,0 +1,160 @@
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import asyncio
+import logging
+import os
+import re
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Off by default: every variant is its own uncached "advanced" Tavily call.
+SEARCH_FANOUT_ENABLED = os.getenv("SEARCH_FANOUT_ENABLED", "false").lower() == "true"
+SEARCH_FANOUT_QUERIES = int(os.getenv("SEARCH_FANOUT_QUERIES", "2"))
+# Seconds the whole fan-out may take; searches still running are dropped.
+SEARCH_FANOUT_DEADLINE = float(os.getenv("SEARCH_FANOUT_DEADLINE", "4"))
+SEARCH_FANOUT_MAX_RESULTS = int(os.getenv("SEARCH_FANOUT_MAX_RESULTS", "5"))
+
+STOPWORDS = frozenset("""
+a an the and or but of to in on at for from by with about as into than then
+is are was were be been being do does did can could should would will shall may might must
+i me my we our you your he she it its they them their this that these those
+what which who whom whose when where why how please tell explain give show find
+""".split())
+
+TRACKING_PARAMS = re.compile(r"^(utm_.*|gclid|fbclid|mc_[ce]id|ref|ref_src)$")
+
+
+def canonical_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if not TRACKING_PARAMS.match(k)))
+    return urlunsplit(("", host, parts.path.rstrip("/") or "/", query, ""))
+
+
+def query_variants(message: str, limit: int) -> List[str]:
+    """The message itself, then its keywords, then each of its clauses, so
+    a multi-part question also searches for every part on its own."""
+    message = " ".join(message.split())
+    variants = [message]
+
+    def keywords(text: str) -> str:
+        return " ".join(w for w in re.findall(r"[\w'-]+", text) if w.lower() not in STOPWORDS)
+
+    variants.append(keywords(message))
+    for clause in re.split(r"[?;,]|\band\b|\bvs\.?\b|\bversus\b", message, flags=re.IGNORECASE):
+        clause = keywords(clause)
+        if len(clause.split()) >= 2:
+            variants.append(clause)
+
+    unique, seen = [], set()
+    for variant in variants:
+        key = variant.lower()
+        if variant and key not in seen:
+            seen.add(key)
+            unique.append(variant)
+    return unique[:limit]
+
+
+class SearchFanout:
+    """Runs a few variants of the query against ``search`` concurrently and
+    merges what comes back within ``deadline``.
+
+    Results are interleaved by rank across variants, the original query
+    first, and deduplicated by canonical URL. A variant that fails or misses
+    the deadline only costs its own results; when every variant does, the
+    result list is empty rather than an error. ``answer`` comes from the
+    first variant that has one.
+    """
+
+    def __init__(
+            self,
+            search,
+            queries: int = SEARCH_FANOUT_QUERIES,
+            deadline: float = SEARCH_FANOUT_DEADLINE,
+            max_results: int = SEARCH_FANOUT_MAX_RESULTS,
+            enabled: bool = SEARCH_FANOUT_ENABLED
+    ):
+        self.search = search
+        self.queries = queries
+        self.deadline = deadline
+        self.max_results = max_results
+        self.enabled = enabled
+        self.requests = 0
+        self.variants = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.duplicates = 0
+
+    async def _one(self, query: str) -> dict:
+        value = await self.search.ainvoke({"query": query})
+        if not isinstance(value, dict) or "error" in value:
+            raise RuntimeError(f"search failed: {value!r:.200}")
+        return value
+
+    async def ainvoke(self, payload: dict) -> dict:
+        if not self.enabled:
+            return await self.search.ainvoke(payload)
+
+        variants = query_variants(payload["query"], self.queries)
+        self.requests += 1
+        self.variants += len(variants)
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self._one(v)) for v in variants]
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+        responses = []
+        for variant, task in zip(variants, tasks):
+            if task not in done:
+                self.timed_out += 1
+                logger.warning("search for %r missed the %.1fs deadline", variant, self.deadline)
+            elif task.exception() is not None:
+                self.failed += 1
+                logger.warning("search for %r failed: %s", variant, task.exception())
+            else:
+                responses.append(task.result())
+
+        results, seen = [], set()
+        ranked = [r.get("results") or [] for r in responses]
+        for rank in range(max(map(len, ranked), default=0)):
+            for hits in ranked:
+                if rank >= len(hits):
+                    continue
+                key = canonical_url(hits[rank]["url"])
+                if key in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(key)
+                results.append(hits[rank])
+
+        logger.info(
+            "web search: %d of %d variants in %.2fs, %d results",
+            len(responses), len(variants), time.perf_counter() - start, len(results)
+        )
+        return {
+            "query": payload["query"],
+            "results": results[:self.max_results],
+            "answer": next((r["answer"] for r in responses if r.get("answer")), None)
+        }
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "variants": self.variants,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "duplicates": self.duplicates,
+        }
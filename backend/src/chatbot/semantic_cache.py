@@ -0,0 +1,152 @@
+from typing import Awaitable, Callable, Optional
+
+import os
+import re
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2048"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "512"))
+# Optional embedding model name; when unset the local hashing embedder is used.
+SEMANTIC_CACHE_EMBED_MODEL = os.getenv("SEMANTIC_CACHE_EMBED_MODEL", "")
+
+
+def hashing_vector(text: str, dim: int = SEMANTIC_CACHE_DIM) -> np.ndarray:
+    """Local bag of words + character trigrams, feature-hashed into ``dim``
+    buckets. It needs no model, costs microseconds and is good enough to
+    match rephrasings that share most of their wording."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    words = re.findall(r"\w+", text)
+    features = words + [
+        f"#{w[i:i + 3]}" for w in words for i in range(max(len(w) - 2, 1))
+    ]
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode())
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    return vector
+
+
+def hashing_embedder(dim: int = SEMANTIC_CACHE_DIM) -> Callable[[str], Awaitable[np.ndarray]]:
+    async def embed(text: str) -> np.ndarray:
+        return hashing_vector(text, dim)
+
+    return embed
+
+
+async def replay(answer: str):
+    yield answer
+
+
+class RoleBucket:
+    def __init__(self, capacity: int, dim: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.values = [None] * capacity
+        self.size = 0
+
+    def slot(self, now: float) -> int:
+        # Append while there is room, then reuse an expired row, and only
+        # then evict the least recently used one.
+        if self.size < len(self.values):
+            self.size += 1
+            return self.size - 1
+        expired = np.flatnonzero(self.expires_at <= now)
+        if expired.size:
+            return int(expired[0])
+        return int(np.argmin(self.last_used))
+
+
+class SemanticCache:
+    """Nearest-neighbour answer cache keyed on ``(role, use_web_search)``.
+
+    Each key owns a preallocated float32 matrix of unit-length query
+    embeddings, so a lookup is one matrix-vector product.
+    """
+
+    def __init__(
+            self,
+            embed: Optional[Callable[[str], Awaitable[np.ndarray]]] = None,
+            threshold: float = SEMANTIC_CACHE_THRESHOLD,
+            max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl: float = SEMANTIC_CACHE_TTL,
+            dim: int = SEMANTIC_CACHE_DIM,
+            enabled: bool = SEMANTIC_CACHE_ENABLED
+    ):
+        self.embed = embed or hashing_embedder(dim)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._buckets = {}
+        self.hits = 0
+        self.misses = 0
+
+    def applies_to(self, req, history=None) -> bool:
+        # Replies that depend on earlier turns cannot be shared.
+        if not self.enabled or getattr(req, "bypass_cache", False):
+            return False
+        return not (history and (history.summary or history.turns or history.recalled))
+
+    async def _vector(self, message: str) -> np.ndarray:
+        vector = np.asarray(await self.embed(message), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def lookup(self, req):
+        bucket = self._buckets.get((req.role, req.use_web_search))
+        vector = await self._vector(req.message)
+        if bucket is None or bucket.size == 0:
+            self.misses += 1
+            return vector, None
+
+        now = time.time()
+        scores = bucket.vectors[:bucket.size] @ vector
+        scores[bucket.expires_at[:bucket.size] <= now] = -1.0
+        best = int(np.argmax(scores))
+
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return vector, None
+
+        bucket.last_used[best] = now
+        self.hits += 1
+        return vector, bucket.values[best]
+
+    def store(self, req, vector: np.ndarray, result: dict):
+        key = (req.role, req.use_web_search)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = RoleBucket(self.max_entries, vector.shape[0])
+
+        now = time.time()
+        i = bucket.slot(now)
+        bucket.vectors[i] = vector
+        bucket.expires_at[i] = now + self.ttl
+        bucket.last_used[i] = now
+        bucket.values[i] = {"answer": result["answer"], "urls": list(result["urls"])}
+
+    async def record(self, req, vector: np.ndarray, urls, tokens):
+        # Pass a token stream through and store the full answer at the end.
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            yield token
+        self.store(req, vector, {"answer": "".join(parts), "urls": urls})
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": sum(b.size for b in self._buckets.values()),
+        }
@@ -0,0 +1,88 @@
+from typing import Awaitable, Callable, Dict, Hashable
+
+import asyncio
+import os
+
+from .search_cache import normalize_query
+
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+def request_key(req, history=None) -> tuple:
+    # Replies that depend on earlier turns are only shared between callers
+    # with the same visible history, which in practice means new sessions.
+    return (
+        req.role,
+        req.use_web_search,
+        normalize_query(req.message),
+        history.as_text() if history else "",
+        tuple(r.id for r in history.recalled) if history else ()
+    )
+
+
+class Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one in-flight task.
+
+    The work runs in its own task, so a caller that goes away (client
+    disconnect cancels its request) does not cancel the result the other
+    callers are waiting for; the task is only cancelled once every caller
+    has left. Errors propagate to all callers and are not remembered: the
+    next call after a failure starts a fresh attempt.
+    """
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[Hashable, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[dict]]) -> dict:
+        if not self.enabled:
+            return await work()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = Flight(asyncio.create_task(work()))
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Detach first so a caller arriving meanwhile starts afresh
+                # instead of joining a task that is being cancelled.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+            raise
+        flight.waiters -= 1
+
+        # Every caller gets its own copy to persist and mutate.
+        return {**result, "urls": list(result["urls"])}
+
+    def _finish(self, key: Hashable, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Mark the exception as retrieved even if every caller left.
+            flight.task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+        }
@@ -0,0 +1,321 @@
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import asyncio
+import json
+import logging
+import os
+
+import zstandard
+
+from .models import ArchiveDictionary, ChatMessage, ChatSession, SessionArchive, SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# Sessions with no message for ARCHIVE_AFTER_DAYS move out of the messages
+# table into one zstd blob each. Archived sessions drop out of full-text
+# search until they are reopened.
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SESSIONS = int(os.getenv("ARCHIVE_BATCH_SESSIONS", "200"))
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE", "0.05"))
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "9"))
+# Chat sessions are small and alike, so a shared dictionary trained on the
+# first batch does most of the compressing.
+ARCHIVE_DICT_SIZE = int(os.getenv("ARCHIVE_DICT_SIZE", str(32 * 1024)))
+ARCHIVE_DICT_MIN_SAMPLES = int(os.getenv("ARCHIVE_DICT_MIN_SAMPLES", "100"))
+
+_dictionaries: Dict[int, zstandard.ZstdCompressionDict] = {}
+
+
+def _urls(value) -> list:
+    return json.loads(value) if isinstance(value, str) else (value or [])
+
+
+def _payload(records: list) -> bytes:
+    return json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+async def get_dictionary(db: AsyncSession, dictionary_id: Optional[int]):
+    if dictionary_id is None:
+        return None
+    dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None:
+        data = await db.scalar(select(ArchiveDictionary.data).where(ArchiveDictionary.id == dictionary_id))
+        dictionary = _dictionaries[dictionary_id] = zstandard.ZstdCompressionDict(data)
+    return dictionary
+
+
+async def unpack_archive(db: AsyncSession, archive: SessionArchive) -> list:
+    """The archived messages as [id, sender, message, urls, created_at]
+    records, oldest first."""
+    dictionary = await get_dictionary(db, archive.dictionary_id)
+    return json.loads(zstandard.ZstdDecompressor(dict_data=dictionary).decompress(archive.data))
+
+
+def to_messages(session_id: int, records: list) -> List[ChatMessage]:
+    # Detached entities shaped like rows read from the messages table.
+    return [
+        ChatMessage(
+            id=message_id,
+            session_id=session_id,
+            sender=sender,
+            message=message,
+            urls=json.dumps(urls),
+            created_at=datetime.fromisoformat(created_at) if created_at else None
+        ) for message_id, sender, message, urls, created_at in records
+    ]
+
+
+async def read_archived_messages(
+        db: AsyncSession,
+        user_id: int,
+        session_id: int
+) -> Optional[List[ChatMessage]]:
+    # None when the session is not archived (or not the user's).
+    archive = await db.scalar(
+        select(SessionArchive)
+        .join(ChatSession, ChatSession.id == SessionArchive.session_id)
+        .where(
+            SessionArchive.session_id == session_id,
+            ChatSession.user_id == user_id
+        )
+    )
+    if archive is None:
+        return None
+    return to_messages(session_id, await unpack_archive(db, archive))
+
+
+async def restore_session(db: AsyncSession, session_id: int) -> int:
+    """Moves an archived session back into the messages table, in the
+    caller's transaction, before it takes new messages. The messages get
+    new ids; their order and timestamps are kept."""
+    archive = await db.get(SessionArchive, session_id)
+    if archive is None:
+        return 0
+
+    records = await unpack_archive(db, archive)
+    if records:
+        await db.execute(ChatMessage.__table__.insert(), [
+            {
+                "session_id": session_id,
+                "sender": sender,
+                "message": message,
+                "urls": json.dumps(urls),
+                "created_at": datetime.fromisoformat(created_at) if created_at else None
+            } for _, sender, message, urls, created_at in records
+        ])
+    await db.delete(archive)
+    await db.flush()
+    return len(records)
+
+
+async def _train_dictionary(db: AsyncSession, samples: List[bytes]) -> Optional[int]:
+    if len(samples) < ARCHIVE_DICT_MIN_SAMPLES:
+        return None
+    try:
+        trained = zstandard.train_dictionary(ARCHIVE_DICT_SIZE, samples)
+    except zstandard.ZstdError as exc:
+        logger.warning("archive dictionary training failed: %s", exc)
+        return None
+    dictionary = ArchiveDictionary(data=trained.as_bytes())
+    db.add(dictionary)
+    await db.flush()
+    logger.info("trained a %d byte archive dictionary on %d sessions", len(dictionary.data), len(samples))
+    return dictionary.id
+
+
+async def archive_idle_sessions(
+        db: AsyncSession,
+        idle_before: datetime,
+        batch_size: int = ARCHIVE_BATCH_SESSIONS,
+        level: int = ARCHIVE_ZSTD_LEVEL
+) -> Optional[dict]:
+    """Archives up to ``batch_size`` sessions idle since ``idle_before`` in
+    one transaction. Returns what was moved, or None when nothing is left.
+
+    Messages written to an archived session by a racing request stay in
+    the messages table; reads merge them with the archive and the next run
+    folds them in.
+    """
+    ids = list(await db.scalars(
+        select(ChatSession.id)
+        .where(
+            ChatSession.user_id.is_not(None),
+            func.coalesce(ChatSession.last_message_at, ChatSession.created_at) < idle_before,
+            exists().where(ChatMessage.session_id == ChatSession.id)
+        )
+        .order_by(ChatSession.id)
+        .limit(batch_size)
+    ))
+    if not ids:
+        return None
+
+    rows = await db.execute(
+        select(
+            ChatMessage.id,
+            ChatMessage.session_id,
+            ChatMessage.sender,
+            ChatMessage.message,
+            ChatMessage.urls,
+            ChatMessage.created_at
+        )
+        .where(ChatMessage.session_id.in_(ids))
+        .order_by(ChatMessage.session_id, ChatMessage.id)
+    )
+    records: Dict[int, list] = {session_id: [] for session_id in ids}
+    last_id = 0
+    for r in rows:
+        records[r.session_id].append([
+            r.id, r.sender, r.message, _urls(r.urls), r.created_at.isoformat() if r.created_at else None
+        ])
+        last_id = max(last_id, r.id)
+
+    existing = {
+        a.session_id: a
+        for a in await db.scalars(select(SessionArchive).where(SessionArchive.session_id.in_(ids)))
+    }
+    for session_id, archive in existing.items():
+        records[session_id] = await unpack_archive(db, archive) + records[session_id]
+
+    payloads = {session_id: _payload(r) for session_id, r in records.items()}
+    dictionary_id = await db.scalar(select(func.max(ArchiveDictionary.id)))
+    if dictionary_id is None:
+        dictionary_id = await _train_dictionary(db, list(payloads.values()))
+    compressor = zstandard.ZstdCompressor(level=level, dict_data=await get_dictionary(db, dictionary_id))
+
+    moved = {"sessions": len(ids), "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    for session_id, payload in payloads.items():
+        data = compressor.compress(payload)
+        archive = existing.get(session_id) or SessionArchive(session_id=session_id)
+        archive.dictionary_id = dictionary_id
+        archive.message_count = len(records[session_id])
+        archive.raw_bytes = len(payload)
+        archive.data = data
+        archive.archived_at = datetime.utcnow()
+        db.add(archive)
+        moved["messages"] += archive.message_count
+        moved["raw_bytes"] += len(payload)
+        moved["stored_bytes"] += len(data)
+
+    # Only the rows read above; anything newer stays hot.
+    await db.execute(
+        delete(ChatMessage)
+        .where(ChatMessage.session_id.in_(ids), ChatMessage.id <= last_id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return moved
+
+
+async def archive_summary(db: AsyncSession) -> dict:
+    row = (await db.execute(select(
+        func.count(),
+        func.coalesce(func.sum(SessionArchive.message_count), 0),
+        func.coalesce(func.sum(SessionArchive.raw_bytes), 0),
+        func.coalesce(func.sum(func.length(SessionArchive.data)), 0)
+    ))).one()
+    sessions, messages, raw_bytes, stored_bytes = row
+    dictionary_bytes = await db.scalar(
+        select(func.coalesce(func.sum(func.length(ArchiveDictionary.data)), 0))
+    )
+    stored_bytes += dictionary_bytes
+    return {
+        "sessions": sessions,
+        "messages": messages,
+        "raw_bytes": raw_bytes,
+        "stored_bytes": stored_bytes,
+        "saved_bytes": raw_bytes - stored_bytes,
+        "ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+    }
+
+
+class SessionArchiver:
+    def __init__(
+            self,
+            session_factory=SessionLocal,
+            enabled: bool = ARCHIVE_ENABLED,
+            after_days: float = ARCHIVE_AFTER_DAYS,
+            interval: float = ARCHIVE_INTERVAL,
+            batch_size: int = ARCHIVE_BATCH_SESSIONS,
+            pause: float = ARCHIVE_PAUSE
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.sessions = 0
+        self.messages = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.enabled or self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # A cancelled batch rolls back; its sessions are archived next run.
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self, now: datetime = None) -> int:
+        """Archives every session idle past the cutoff, one batch per
+        transaction. Returns the number of sessions archived."""
+        idle_before = (now or datetime.utcnow()) - timedelta(days=self.after_days)
+        archived = 0
+        while True:
+            async with self.session_factory() as db:
+                moved = await archive_idle_sessions(db, idle_before, self.batch_size)
+            if moved is None:
+                break
+            archived += moved["sessions"]
+            self.sessions += moved["sessions"]
+            self.messages += moved["messages"]
+            self.raw_bytes += moved["raw_bytes"]
+            self.stored_bytes += moved["stored_bytes"]
+            await asyncio.sleep(self.pause)
+        self.runs += 1
+        if archived:
+            logger.info("archived %d idle sessions", archived)
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("session archiving failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "after_days": self.after_days,
+            "runs": self.runs,
+            "sessions": self.sessions,
+            "messages": self.messages,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+        }
+
+
+session_archiver = SessionArchiver()
@@ -0,0 +1,39 @@
+"""Index the messages of an existing chat.db for /users/{user_id}/search.
+
+New messages are indexed by triggers as they are written; this is only
+needed once for databases created before the search index existed, and is
+safe to re-run (the index is rebuilt from the messages table).
+
+    uv run python -m src.database.backfill_fts
+    uv run python -m src.database.backfill_fts --database-url sqlite:///./other.db
+"""
+import argparse
+import asyncio
+import time
+
+from .models import DATABASE_URL, build_engine, create_message_search, rebuild_message_search
+
+
+async def backfill(url: str):
+    engine = build_engine(url)
+    if engine.dialect.name != "sqlite":
+        raise SystemExit("Full-text search is only available on SQLite")
+
+    try:
+        start = time.perf_counter()
+        async with engine.begin() as conn:
+            # Creates the FTS table and triggers if this database predates them.
+            await conn.run_sync(create_message_search)
+            await conn.run_sync(rebuild_message_search)
+            indexed = (await conn.exec_driver_sql("SELECT count(*) FROM messages")).scalar()
+    finally:
+        await engine.dispose()
+
+    print(f"indexed {indexed} messages in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.database_url))
@@ -1,15 +1,19 @@
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from .models import (
     User, ChatSession, ChatMessage, get_db
 )
+from sqlalchemy import DateTime, and_, delete, exists, func, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+from .archive import read_archived_messages, restore_session
 from typing import List
 import json
+import re
 
 
-def create_new_user(
-        db: Session,
+async def create_new_user(
+        db: AsyncSession,
         user_name: str,
         user_email_id: str,
         user_password: str
@@ -20,14 +24,14 @@ def create_new_user(
         user_password=user_password,
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
 
     return user
 
 
-def create_new_session(
-        db: Session,
+async def create_new_session(
+        db: AsyncSession,
         title:str,
         user_id:int      
 ):
@@ -36,14 +40,14 @@ def create_new_session(
         user_id=user_id
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
 
     return session
 
 
-def create_new_chat(
-    db:Session,
+async def create_new_chat(
+    db:AsyncSession,
     session_id: int,
     sender: str,
     message: str,
@@ -51,24 +55,482 @@ def create_new_chat(
 ):
     if urls is None:
         urls= []
-        
+
+    now = datetime.utcnow()
     chat = ChatMessage(
         session_id=session_id,
         sender=sender,
         message=message,
-        urls=json.dumps(urls)
+        urls=json.dumps(urls),
+        created_at=now
     )
     db.add(chat)
-    db.commit()
-    db.refresh(chat)
+    await db.execute(
+        update(ChatSession)
+        .where(ChatSession.id == session_id)
+        .values(last_message=message, last_message_at=now)
+    )
+    await db.commit()
 
     return chat
 
 
+async def start_chat_turn(
+        db: AsyncSession,
+        session_id: int,
+        user_id: int,
+        title: str,
+        message: str,
+        history_after: int = 0,
+        history_limit: int = 200,
+        owned: bool = False
+):
+    # Session lookup/creation, the history read and the user message share
+    # a single transaction, so a chat turn costs one commit up front.
+    # Returns (session_id, history, user message id, whether the session is new).
+    if owned:
+        # The caller resolved this session for this user on an earlier turn
+        # (a WebSocket connection keeps it), so the lookup is skipped. The
+        # update still checks ownership: the session may have been deleted
+        # since, in which case this falls back to the lookup below.
+        now = datetime.utcnow()
+        result = await db.execute(
+            update(ChatSession)
+            .where(ChatSession.id == session_id, ChatSession.user_id == user_id)
+            .values(last_message=message, last_message_at=now)
+        )
+        if result.rowcount:
+            history = await get_recent_messages(
+                db=db,
+                session_id=session_id,
+                after_id=history_after,
+                limit=history_limit
+            )
+            user_message = ChatMessage(
+                session_id=session_id,
+                sender="user",
+                message=message,
+                urls=json.dumps([]),
+                created_at=now
+            )
+            db.add(user_message)
+            try:
+                await db.commit()
+                return session_id, history, user_message.id, False
+            except IntegrityError:
+                pass
+        await db.rollback()
+
+    session = None
+    if session_id:
+        session = await db.scalar(
+            select(ChatSession).where(
+                ChatSession.id == session_id,
+                ChatSession.user_id == user_id
+            )
+        )
+
+    created = session is None
+    if created:
+        session = ChatSession(title=title, user_id=user_id)
+        db.add(session)
+        await db.flush()
+        history = []
+    else:
+        # A reopened archived session goes back to the hot table first.
+        await restore_session(db, session.id)
+        history = await get_recent_messages(
+            db=db,
+            session_id=session.id,
+            after_id=history_after,
+            limit=history_limit
+        )
+
+    now = datetime.utcnow()
+    user_message = ChatMessage(
+        session_id=session.id,
+        sender="user",
+        message=message,
+        urls=json.dumps([]),
+        created_at=now
+    )
+    db.add(user_message)
+    session.last_message = message
+    session.last_message_at = now
+    await db.commit()
+
+    return session.id, history, user_message.id, created
+
+
+async def discard_chat_turn(db: AsyncSession, session_id: int, message_id: int, created: bool):
+    # Undoes start_chat_turn for a turn the model turned away, so a retry
+    # does not store the message twice.
+    await db.execute(delete(ChatMessage).where(ChatMessage.id == message_id))
+    if created:
+        await db.execute(delete(ChatSession).where(ChatSession.id == session_id))
+    await db.commit()
+
+
+async def write_chat_batch(
+        db: AsyncSession,
+        chats: List[dict]
+):
+    # Group commit for the write-behind queue: every queued reply is
+    # inserted and the session previews updated in one transaction.
+    now = datetime.utcnow()
+    latest = {c["session_id"]: c["message"] for c in chats}
+
+    # A session deleted while its reply was queued would fail the whole
+    # batch on the foreign key; that reply is dropped instead (id None).
+    live = set(await db.scalars(select(ChatSession.id).where(ChatSession.id.in_(latest))))
+    rows = [
+        ChatMessage(
+            session_id=c["session_id"],
+            sender=c["sender"],
+            message=c["message"],
+            urls=json.dumps(c.get("urls") or []),
+            created_at=now
+        ) if c["session_id"] in live else None
+        for c in chats
+    ]
+    db.add_all([r for r in rows if r is not None])
+
+    for session_id, message in latest.items():
+        await db.execute(
+            update(ChatSession)
+            .where(ChatSession.id == session_id)
+            .values(last_message=message, last_message_at=now)
+        )
+    await db.commit()
+
+    return [r.id if r is not None else None for r in rows]
+
+
+async def get_recent_messages(
+        db: AsyncSession,
+        session_id: int,
+        after_id: int = 0,
+        limit: int = 200
+):
+    # Plain rows rather than entities; the memory builder only needs these
+    # three columns.
+    result = await db.execute(
+        select(ChatMessage.id, ChatMessage.sender, ChatMessage.message)
+        .where(
+            ChatMessage.session_id == session_id,
+            ChatMessage.id > after_id
+        )
+        .order_by(ChatMessage.id.desc())
+        .limit(limit)
+    )
+    messages = result.all()
+    messages.reverse()
+
+    return messages
+
+
+async def list_user_sessions(
+        db: AsyncSession,
+        user_id: int,
+        before: int = None,
+        limit: int = 100
+):
+    # Keyset pagination on the session id, which follows created_at. The
+    # user_id index covers (user_id, id) because id is the SQLite rowid.
+    query = (
+        select(
+            ChatSession.id,
+            ChatSession.title,
+            ChatSession.created_at,
+            ChatSession.last_message,
+            ChatSession.last_message_at
+        )
+        .where(ChatSession.user_id == user_id)
+    )
+    if before is not None:
+        query = query.where(ChatSession.id < before)
+
+    result = await db.execute(query.order_by(ChatSession.id.desc()).limit(limit))
+    return result.all()
+
+
+async def list_session_messages(
+        db: AsyncSession,
+        user_id: int,
+        session_id: int,
+        before: int = None,
+        after: int = None,
+        limit: int = 100
+):
+    archived = await read_archived_messages(db, user_id, session_id)
+    if archived is not None:
+        hot = await db.scalars(select(ChatMessage).where(ChatMessage.session_id == session_id))
+        return page_messages(archived + list(hot), before, after, limit)
+
+    # One statement per page: ownership is checked through the join and the
+    # cursor message's timestamp is resolved in a subquery, so the page is
+    # read straight off the (session_id, created_at) index.
+    query = (
+        select(ChatMessage)
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(
+            ChatMessage.session_id == session_id,
+            ChatSession.user_id == user_id
+        )
+    )
+
+    newest_first = after is None
+    if before is not None:
+        cursor_at = select(ChatMessage.created_at).where(ChatMessage.id == before).scalar_subquery()
+        query = query.where(or_(
+            ChatMessage.created_at < cursor_at,
+            and_(ChatMessage.created_at == cursor_at, ChatMessage.id < before)
+        ))
+    if after is not None:
+        cursor_at = select(ChatMessage.created_at).where(ChatMessage.id == after).scalar_subquery()
+        query = query.where(or_(
+            ChatMessage.created_at > cursor_at,
+            and_(ChatMessage.created_at == cursor_at, ChatMessage.id > after)
+        ))
+
+    if newest_first:
+        query = query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+    else:
+        query = query.order_by(ChatMessage.created_at, ChatMessage.id)
 
+    messages = list(await db.scalars(query.limit(limit)))
+    if newest_first:
+        messages.reverse()
 
+    return messages
 
 
+def page_messages(
+        messages: List[ChatMessage],
+        before: int = None,
+        after: int = None,
+        limit: int = 100
+) -> List[ChatMessage]:
+    # list_session_messages' paging, in memory, for rehydrated archives.
+    messages = sorted(messages, key=lambda m: (m.created_at, m.id))
+    positions = {m.id: i for i, m in enumerate(messages)}
+    if before is not None:
+        messages = messages[:positions[before]] if before in positions else []
+    if after is not None:
+        if after not in positions:
+            return []
+        return messages[positions[after] + 1:][:limit]
+    return messages[-limit:]
 
 
+def to_fts_query(query: str) -> str:
+    # User input is never passed to MATCH as syntax: every word becomes a
+    # quoted term and all of them must match. No prefix queries; without a
+    # prefix index they merge the doclists of every matching word.
+    return " ".join(f'"{t}"' for t in re.findall(r"\w+", query))
+
+
+async def search_user_messages(
+        db: AsyncSession,
+        user_id: int,
+        query: str,
+        offset: int = 0,
+        limit: int = 20
+):
+    # bm25() is lower for better matches; the owner column gets weight 0 so
+    # only the message text affects the ranking.
+    terms = to_fts_query(query)
+    if not terms:
+        return []
+
+    result = await db.execute(
+        text("""
+            SELECT
+                m.id,
+                m.session_id,
+                s.title,
+                m.sender,
+                m.created_at,
+                snippet(messages_fts, 0, '<mark>', '</mark>', '…', 16) AS snippet,
+                bm25(messages_fts, 1.0, 0.0) AS rank
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN sessions s ON s.id = m.session_id
+            WHERE messages_fts MATCH :match AND s.user_id = :user_id
+            ORDER BY rank, m.id DESC
+            LIMIT :limit OFFSET :offset
+        """).columns(created_at=DateTime),
+        {
+            "match": f'owner:"{int(user_id)}" AND message:({terms})',
+            "user_id": user_id,
+            "limit": limit,
+            "offset": offset
+        }
+    )
+    return result.all()
+
+
+async def get_messages_for_index(
+        db: AsyncSession,
+        user_id: int,
+        after_id: int = 0,
+        limit: int = 1000
+):
+    result = await db.execute(
+        select(ChatMessage.id, ChatMessage.session_id, ChatMessage.message)
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(
+            ChatSession.user_id == user_id,
+            ChatMessage.id > after_id
+        )
+        .order_by(ChatMessage.id)
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def get_messages_by_ids(
+        db: AsyncSession,
+        user_id: int,
+        message_ids: List[int]
+):
+    # Ownership is checked again here; the index is only a list of ids.
+    if not message_ids:
+        return []
+
+    result = await db.execute(
+        select(
+            ChatMessage.id,
+            ChatMessage.session_id,
+            ChatSession.title,
+            ChatMessage.sender,
+            ChatMessage.message,
+            ChatMessage.created_at
+        )
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(
+            ChatSession.user_id == user_id,
+            ChatMessage.id.in_(message_ids)
+        )
+    )
+    rows = {r.id: r for r in result.all()}
+    return [rows[i] for i in message_ids if i in rows]
+
+
+def _owned_sessions(user_id: int, session_id: int = None):
+    query = select(ChatSession.id).where(ChatSession.user_id == user_id)
+    if session_id is not None:
+        query = query.where(ChatSession.id == session_id)
+    return query
+
+
+async def count_session_messages(
+        db: AsyncSession,
+        user_id: int,
+        session_id: int = None,
+        cap: int = None
+) -> int:
+    # With a cap, counting stops there: enough to tell a large account
+    # without walking all of its messages.
+    query = select(ChatMessage.id).where(ChatMessage.session_id.in_(_owned_sessions(user_id, session_id)))
+    if cap is not None:
+        query = query.limit(cap)
+    return await db.scalar(select(func.count()).select_from(query.subquery()))
+
+
+async def _remove_sessions(
+        db: AsyncSession,
+        user_id: int,
+        session_id: int = None,
+        detach: bool = False
+) -> int:
+    owned = _owned_sessions(user_id, session_id)
+    if detach:
+        # Detached sessions belong to nobody, so every user-scoped query
+        # stops seeing them at once; purge_detached_sessions removes them.
+        result = await db.execute(
+            update(ChatSession)
+            .where(ChatSession.id.in_(owned))
+            .values(user_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
+
+    # One set-based DELETE per table. Messages go first explicitly so
+    # databases created before the ON DELETE CASCADE keys work as well.
+    await db.execute(
+        delete(ChatMessage)
+        .where(ChatMessage.session_id.in_(owned))
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        delete(ChatSession)
+        .where(ChatSession.id.in_(owned))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+async def delete_user_session(
+        db: AsyncSession,
+        user_id: int,
+        session_id: int,
+        detach: bool = False
+) -> bool:
+    removed = await _remove_sessions(db, user_id, session_id, detach)
+    await db.commit()
+    return removed > 0
+
+
+async def delete_user_account(
+        db: AsyncSession,
+        user_id: int,
+        detach: bool = False
+) -> bool:
+    await _remove_sessions(db, user_id, detach=detach)
+    result = await db.execute(
+        delete(User)
+        .where(User.id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def purge_detached_sessions(
+        db: AsyncSession,
+        batch_size: int = 2000
+) -> int:
+    # One short transaction of at most batch_size messages, then the
+    # detached sessions left empty. Returns the number of rows removed.
+    doomed = (
+        select(ChatMessage.id)
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(ChatSession.user_id.is_(None))
+        .limit(batch_size)
+    )
+    result = await db.execute(
+        delete(ChatMessage)
+        .where(ChatMessage.id.in_(doomed))
+        .execution_options(synchronize_session=False)
+    )
+    removed = result.rowcount
+
+    if removed < batch_size:
+        empty = (
+            select(ChatSession.id)
+            .where(
+                ChatSession.user_id.is_(None),
+                ~exists().where(ChatMessage.session_id == ChatSession.id)
+            )
+            .limit(batch_size)
+        )
+        result = await db.execute(
+            delete(ChatSession)
+            .where(ChatSession.id.in_(empty))
+            .execution_options(synchronize_session=False)
+        )
+        removed += result.rowcount
 
+    await db.commit()
+    return removed
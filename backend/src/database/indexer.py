@@ -0,0 +1,90 @@
+from functools import partial
+from typing import Optional, Set
+
+import asyncio
+import logging
+import os
+
+from .db import get_messages_for_index
+from .models import SessionLocal
+from ..chatbot.history_index import history_index
+
+
+logger = logging.getLogger(__name__)
+
+# New messages are embedded by a background task after each turn, so a
+# history search only has a short catch-up left on the request path. Only
+# users who already have an index are kept up to date; the first search
+# creates it.
+BACKGROUND_INDEX_ENABLED = os.getenv("BACKGROUND_INDEX_ENABLED", "true").lower() == "true"
+
+
+class HistoryIndexer:
+    def __init__(
+            self,
+            session_factory=SessionLocal,
+            index=history_index,
+            enabled: bool = BACKGROUND_INDEX_ENABLED
+    ):
+        self.session_factory = session_factory
+        self.index = index
+        self.enabled = enabled
+        self._pending: Set[int] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.synced = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.enabled or self.running:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Appends are not interrupted mid-row; whatever is left is indexed by
+        # the next sync after a restart.
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self, user_id: int):
+        if not self.running or not self.index.has(user_id):
+            return
+        self._pending.add(user_id)
+        self._wake.set()
+
+    async def _load(self, user_id: int, after_id: int, limit: int):
+        # A session per batch, so no connection is held while embedding.
+        async with self.session_factory() as db:
+            return await get_messages_for_index(db, user_id, after_id, limit)
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                user_id = self._pending.pop()
+                try:
+                    await self.index.sync(user_id, partial(self._load, user_id))
+                    self.synced += 1
+                except Exception:
+                    logger.exception("history index sync for user %s failed", user_id)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "synced": self.synced,
+        }
+
+
+history_indexer = HistoryIndexer()
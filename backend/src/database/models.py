@@ -1,14 +1,74 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime, JSON
+from sqlalchemy import event, inspect, text, Index, Column, Integer, String, Text, ForeignKey, DateTime, JSON, LargeBinary
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
 from datetime import datetime
 
-DATABASE_URL = "sqlite:///./chat.db"
+import logging
+import os
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-    )
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./chat.db")
+
+# SQLite tuning, applied to every new connection.
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pool sizing for server databases such as PostgreSQL.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str):
+    # Accept plain sqlite:/// and postgresql:// URLs from older configs.
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def build_engine(url: str):
+    url = async_url(url)
+
+    if url.get_backend_name() != "sqlite":
+        return create_async_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+
+    engine = create_async_engine(url)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers proceed while a writer holds the lock; NORMAL only
+        # fsyncs at checkpoints, which is safe in WAL mode.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        # Off by default in SQLite; the ON DELETE CASCADE keys rely on it.
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return engine
+
+
+engine = build_engine(DATABASE_URL)
 
 Base = declarative_base()
 
@@ -21,35 +81,48 @@ class User(Base):
     user_password = Column(String, nullable=False)
     create_at = Column(DateTime, default=datetime.utcnow)
 
+    # Children are removed by the database (ON DELETE CASCADE) or by the
+    # bulk deletes in db.py, never loaded into the session to be deleted.
     sessions = relationship(
         "ChatSession",
         back_populates="user",
-        cascade="all, delete"
+        cascade="all, delete",
+        passive_deletes=True
     )
 
 class ChatSession(Base):
     __tablename__= "sessions"
 
-    user_id=Column(Integer, ForeignKey("users.id"))
-    
+    # NULL once the session is detached for a background purge.
+    user_id=Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+
     id=Column(Integer, primary_key=True, index=True)
     title= Column(String, default="New Chat")
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Denormalized preview of the newest message, maintained by
+    # create_new_chat so the sidebar never has to load message rows.
+    last_message = Column(Text, nullable=True)
+    last_message_at = Column(DateTime, nullable=True)
+
     user = relationship("User", back_populates="sessions")
 
     messages = relationship(
         "ChatMessage",
         back_populates="session",
         order_by="ChatMessage.created_at",
-        cascade="all, delete"
+        cascade="all, delete",
+        passive_deletes=True
         )
     
 class ChatMessage(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_session_id_created_at", "session_id", "created_at"),
+    )
 
     id=Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"))
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), index=True)
     sender=Column(String)
     message=Column(Text)
     urls=Column(JSON, nullable=True)
@@ -61,14 +134,123 @@ class ChatMessage(Base):
         back_populates="messages"
     )
 
-Base.metadata.create_all(bind=engine)
+class ArchiveDictionary(Base):
+    __tablename__ = "archive_dictionaries"
+
+    # A zstd dictionary trained on archived sessions; shared by every
+    # archive compressed with it.
+    id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SessionArchive(Base):
+    __tablename__ = "session_archives"
+
+    # Cold tier: every message of an idle session in one zstd blob. The
+    # session row itself stays, so listings are unchanged.
+    session_id = Column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), primary_key=True)
+    dictionary_id = Column(Integer, ForeignKey("archive_dictionaries.id"), nullable=True)
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+# Full-text index over messages.message for the history search endpoint.
+# Each row also carries the owning user id as an indexed column, so a search
+# is an intersection with that user's postings and bm25 only ranks the
+# user's own matches instead of every match in the database. Triggers keep
+# it in step with every insert, update and delete of a message.
+MESSAGES_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        message,
+        owner,
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, message, owner)
+        SELECT new.id, new.message, sessions.user_id FROM sessions WHERE sessions.id = new.session_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+        UPDATE messages_fts SET message = new.message WHERE rowid = new.id;
+    END
+    """,
+]
+
+
+def create_message_search(conn) -> bool:
+    # FTS5 is SQLite only; other databases simply have no search index.
+    # Returns True when the index was created by this call.
+    if conn.dialect.name != "sqlite":
+        return False
+    existed = inspect(conn).has_table("messages_fts")
+    for statement in MESSAGES_FTS_DDL:
+        conn.execute(text(statement))
+    return not existed
+
+
+def rebuild_message_search(conn):
+    # Re-indexes every message from scratch; safe to run repeatedly.
+    conn.execute(text("DELETE FROM messages_fts"))
+    conn.execute(text("""
+        INSERT INTO messages_fts(rowid, message, owner)
+        SELECT messages.id, messages.message, sessions.user_id
+        FROM messages JOIN sessions ON sessions.id = messages.session_id
+    """))
+    conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')"))
+
+
+def upgrade_schema(conn):
+    # create_all only creates missing tables, so columns and indexes added
+    # after a chat.db was first created are patched in here.
+    inspector = inspect(conn)
+    session_columns = {c["name"] for c in inspector.get_columns("sessions")}
+
+    if "last_message" not in session_columns:
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN last_message TEXT"))
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN last_message_at DATETIME"))
+        conn.execute(text("""
+            UPDATE sessions SET
+                last_message = (
+                    SELECT message FROM messages
+                    WHERE messages.session_id = sessions.id
+                    ORDER BY messages.id DESC LIMIT 1
+                ),
+                last_message_at = (
+                    SELECT created_at FROM messages
+                    WHERE messages.session_id = sessions.id
+                    ORDER BY messages.id DESC LIMIT 1
+                )
+        """))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+    if create_message_search(conn) and conn.execute(text("SELECT 1 FROM messages LIMIT 1")).first():
+        logger.warning(
+            "messages_fts was just created and is empty; index existing messages "
+            "with: python -m src.database.backfill_fts"
+        )
+
+
+async def init_db(bind=None):
+    async with (bind or engine).begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    db=SessionLocal()
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
\ No newline at end of file
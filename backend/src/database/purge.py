@@ -0,0 +1,122 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+
+import asyncio
+import logging
+import os
+
+from .db import count_session_messages, delete_user_account, delete_user_session, purge_detached_sessions
+from .models import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# Accounts and sessions with more messages than the threshold are detached
+# at once and deleted by a background task in batches, each its own short
+# transaction, so the SQLite write lock is never held for the whole purge.
+BACKGROUND_PURGE_ENABLED = os.getenv("BACKGROUND_PURGE_ENABLED", "true").lower() == "true"
+BACKGROUND_PURGE_THRESHOLD = int(os.getenv("BACKGROUND_PURGE_THRESHOLD", "10000"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "2000"))
+# Seconds between batches, leaving the lock to the request path.
+PURGE_PAUSE = float(os.getenv("PURGE_PAUSE", "0.05"))
+
+
+class SessionPurger:
+    def __init__(
+            self,
+            session_factory=SessionLocal,
+            enabled: bool = BACKGROUND_PURGE_ENABLED,
+            threshold: int = BACKGROUND_PURGE_THRESHOLD,
+            batch_size: int = PURGE_BATCH_SIZE,
+            pause: float = PURGE_PAUSE
+    ):
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.pause = pause
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.inline = 0
+        self.deferred = 0
+        self.purged = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if not self.enabled or self.running:
+            return
+        self._wake = asyncio.Event()
+        # Sessions detached before a restart are picked up straight away.
+        self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Each batch is its own transaction; a cancelled one rolls back and
+        # the rest is purged after the next start.
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _defer(self, db: AsyncSession, user_id: int, session_id: int = None) -> bool:
+        if not self.running:
+            return False
+        count = await count_session_messages(db, user_id, session_id, cap=self.threshold + 1)
+        return count > self.threshold
+
+    def _record(self, deferred: bool):
+        if deferred:
+            self.deferred += 1
+            self._wake.set()
+        else:
+            self.inline += 1
+
+    async def delete_user(self, db: AsyncSession, user_id: int) -> bool:
+        deferred = await self._defer(db, user_id)
+        deleted = await delete_user_account(db, user_id, detach=deferred)
+        if deleted:
+            self._record(deferred)
+        return deleted
+
+    async def delete_session(self, db: AsyncSession, user_id: int, session_id: int) -> bool:
+        deferred = await self._defer(db, user_id, session_id)
+        deleted = await delete_user_session(db, user_id, session_id, detach=deferred)
+        if deleted:
+            self._record(deferred)
+        return deleted
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                while True:
+                    async with self.session_factory() as db:
+                        removed = await purge_detached_sessions(db, self.batch_size)
+                    if not removed:
+                        break
+                    self.purged += removed
+                    await asyncio.sleep(self.pause)
+            except Exception:
+                logger.exception("background purge failed; retrying")
+                await asyncio.sleep(max(self.pause, 5))
+                self._wake.set()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "inline": self.inline,
+            "deferred": self.deferred,
+            "purged_rows": self.purged,
+        }
+
+
+session_purger = SessionPurger()
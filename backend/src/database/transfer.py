@@ -0,0 +1,263 @@
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import asyncio
+import json
+import os
+
+import zstandard
+from sqlalchemy import insert, select
+
+from .archive import unpack_archive
+from .models import ChatMessage, ChatSession, SessionArchive, SessionLocal
+
+
+# Rows fetched per round trip while exporting; memory stays at about one
+# batch whatever the size of the history.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_ZSTD_LEVEL = int(os.getenv("EXPORT_ZSTD_LEVEL", "3"))
+# Rows per INSERT batch (one executemany) while importing.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+
+# Compressed uploads are inflated this many bytes at a time, so a small
+# body that expands to gigabytes is rejected at the line limit.
+DECOMPRESS_READ_SIZE = 64 * 1024
+
+FORMAT_VERSION = 1
+
+
+def _line(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+def _time(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _urls(value) -> list:
+    # Stored JSON-encoded in a JSON column by the chat writers.
+    return json.loads(value) if isinstance(value, str) else (value or [])
+
+
+async def export_records(user_id: int, session_factory=SessionLocal) -> AsyncIterator[list]:
+    """Yields the export in batches of records: a header, the user's
+    sessions, then their messages grouped by session, hot then archived. Everything is read
+    in one transaction, so the export is a consistent snapshot."""
+    async with session_factory() as db:
+        yield [{"type": "export", "version": FORMAT_VERSION, "user_id": user_id,
+                "exported_at": datetime.utcnow().isoformat()}]
+
+        sessions = await db.stream(
+            select(
+                ChatSession.id,
+                ChatSession.title,
+                ChatSession.created_at,
+                ChatSession.last_message,
+                ChatSession.last_message_at
+            )
+            .where(ChatSession.user_id == user_id)
+            .order_by(ChatSession.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for rows in sessions.partitions():
+            yield [
+                {"type": "session", "id": s.id, "title": s.title, "created_at": _time(s.created_at),
+                 "last_message": s.last_message, "last_message_at": _time(s.last_message_at)}
+                for s in rows
+            ]
+
+        messages = await db.stream(
+            select(
+                ChatMessage.id,
+                ChatMessage.session_id,
+                ChatMessage.sender,
+                ChatMessage.message,
+                ChatMessage.urls,
+                ChatMessage.created_at
+            )
+            .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+            .where(ChatSession.user_id == user_id)
+            .order_by(ChatMessage.session_id, ChatMessage.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for rows in messages.partitions():
+            yield [
+                {"type": "message", "id": m.id, "session_id": m.session_id, "sender": m.sender,
+                 "message": m.message, "urls": _urls(m.urls), "created_at": _time(m.created_at)}
+                for m in rows
+            ]
+
+        # Archived sessions, one decompressed blob at a time.
+        archives = await db.stream(
+            select(SessionArchive)
+            .join(ChatSession, ChatSession.id == SessionArchive.session_id)
+            .where(ChatSession.user_id == user_id)
+            .order_by(SessionArchive.session_id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        async for archive in archives.scalars():
+            yield [
+                {"type": "message", "id": message_id, "session_id": archive.session_id, "sender": sender,
+                 "message": message, "urls": urls, "created_at": created_at}
+                for message_id, sender, message, urls, created_at in await unpack_archive(db, archive)
+            ]
+
+
+async def export_ndjson(user_id: int, compression: Optional[str] = None) -> AsyncIterator[bytes]:
+    compressor = zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL).compressobj() if compression == "zstd" else None
+    async for records in export_records(user_id):
+        data = b"".join(_line(r) for r in records)
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+class _ChunkReader:
+    # Blocking file-like view of an async byte stream, for the zstd reader
+    # running in a worker thread. Each read waits on the event loop.
+    def __init__(self, chunks: AsyncIterator[bytes], loop: asyncio.AbstractEventLoop):
+        self.chunks = chunks
+        self.loop = loop
+        self.pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.pending:
+            chunk = asyncio.run_coroutine_threadsafe(anext(self.chunks, None), self.loop).result()
+            if chunk is None:
+                return b""
+            self.pending = chunk
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+async def _decompressed(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        _ChunkReader(chunks, asyncio.get_running_loop()),
+        read_across_frames=True
+    )
+    while True:
+        piece = await asyncio.to_thread(reader.read, DECOMPRESS_READ_SIZE)
+        if not piece:
+            return
+        yield piece
+
+
+async def _lines(chunks: AsyncIterator[bytes], compressed: bool):
+    buffer = b""
+    async for chunk in _decompressed(chunks) if compressed else chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise ValueError(f"Line longer than {IMPORT_MAX_LINE_BYTES} bytes")
+        for line in lines:
+            yield line
+    yield buffer
+
+
+def _parse_time(value) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+async def import_ndjson(
+        user_id: int,
+        chunks: AsyncIterator[bytes],
+        compressed: bool = False,
+        session_factory=SessionLocal,
+        batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """Imports an export into ``user_id``'s account as new sessions.
+
+    Sessions and messages are inserted ``batch_size`` rows at a time, one
+    executemany per batch, and each batch is committed on its own so a
+    large import does not hold the write lock throughout. Message session
+    ids are mapped to the new session ids; a message whose session was not
+    in the file raises ``ValueError``, leaving the batches committed before
+    it in place.
+    """
+    sessions, messages = [], []
+    session_ids = {}
+    imported = {"sessions": 0, "messages": 0}
+
+    async with session_factory() as db:
+        async def flush_sessions():
+            if not sessions:
+                return
+            result = await db.execute(
+                insert(ChatSession).returning(ChatSession.id, sort_by_parameter_order=True),
+                [{k: v for k, v in s.items() if k != "old_id"} for s in sessions]
+            )
+            for s, new_id in zip(sessions, result.scalars()):
+                session_ids[s["old_id"]] = new_id
+            await db.commit()
+            imported["sessions"] += len(sessions)
+            sessions.clear()
+
+        async def flush_messages():
+            if not messages:
+                return
+            await db.execute(ChatMessage.__table__.insert(), messages)
+            await db.commit()
+            imported["messages"] += len(messages)
+            messages.clear()
+
+        pending = set()
+        number = 0
+        async for line in _lines(chunks, compressed):
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record["type"]
+                if kind == "export":
+                    if record.get("version") != FORMAT_VERSION:
+                        raise ValueError(f"unsupported export version {record.get('version')!r}")
+                elif kind == "session":
+                    sessions.append({
+                        "old_id": record["id"],
+                        "user_id": user_id,
+                        "title": str(record.get("title") or "Imported chat"),
+                        "created_at": _parse_time(record.get("created_at")) or datetime.utcnow(),
+                        "last_message": record.get("last_message"),
+                        "last_message_at": _parse_time(record.get("last_message_at")),
+                    })
+                    pending.add(record["id"])
+                    if len(sessions) >= batch_size:
+                        await flush_sessions()
+                        pending.clear()
+                elif kind == "message":
+                    old_id = record["session_id"]
+                    if old_id not in session_ids:
+                        if old_id not in pending:
+                            raise ValueError(f"unknown session {old_id!r}")
+                        await flush_sessions()
+                        pending.clear()
+                    if record["sender"] not in ("user", "ai"):
+                        raise ValueError(f"unknown sender {record['sender']!r}")
+                    messages.append({
+                        "session_id": session_ids[old_id],
+                        "sender": record["sender"],
+                        "message": str(record["message"]),
+                        "urls": json.dumps(record.get("urls") or []),
+                        "created_at": _parse_time(record.get("created_at")) or datetime.utcnow(),
+                    })
+                    if len(messages) >= batch_size:
+                        await flush_messages()
+                else:
+                    raise ValueError(f"unknown record type {kind!r}")
+            except (KeyError, TypeError, json.JSONDecodeError, ValueError) as exc:
+                raise ValueError(
+                    f"line {number}: {exc}; imported {imported['sessions']} sessions "
+                    f"and {imported['messages']} messages before it"
+                ) from exc
+
+        await flush_sessions()
+        await flush_messages()
+
+    return imported
@@ -0,0 +1,143 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+import asyncio
+import logging
+import os
+
+from .db import create_new_chat, write_chat_batch
+from .models import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+# "group": replies are queued and committed together with whatever other
+#          replies arrived meanwhile; the request waits for its commit.
+# "async": the request returns as soon as the reply is queued. Fewer
+#          fsyncs on the request path, but a crash can lose queued replies.
+# "off":   every reply is committed inline on the request's session.
+WRITE_BEHIND_MODE = os.getenv("WRITE_BEHIND_MODE", "group")
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "256"))
+
+_STOP = object()
+
+
+class ChatWriteQueue:
+    def __init__(
+            self,
+            session_factory=SessionLocal,
+            mode: str = WRITE_BEHIND_MODE,
+            max_batch: int = WRITE_BEHIND_MAX_BATCH
+    ):
+        if mode not in ("group", "async", "off"):
+            raise ValueError(f"Unknown WRITE_BEHIND_MODE: {mode}")
+        self.session_factory = session_factory
+        self.mode = mode
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.written = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.mode == "off" or self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Flush-on-shutdown: the worker drains everything queued before
+        # the sentinel, then exits.
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def append(
+            self,
+            db: AsyncSession,
+            session_id: int,
+            sender: str,
+            message: str,
+            urls: List[str] = None
+    ) -> Optional[int]:
+        if not self.running:
+            chat = await create_new_chat(
+                db=db,
+                session_id=session_id,
+                sender=sender,
+                message=message,
+                urls=urls
+            )
+            return chat.id
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(({
+            "session_id": session_id,
+            "sender": sender,
+            "message": message,
+            "urls": urls or []
+        }, future))
+
+        if self.mode == "async":
+            return None
+        return await asyncio.shield(future)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            # Natural batching: take whatever queued up while the previous
+            # commit was in flight, without adding a linger delay.
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            if _STOP in batch:
+                stopping = True
+                batch = [item for item in batch if item is not _STOP]
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch):
+        chats = [chat for chat, _ in batch]
+        try:
+            ids = await self._write(chats)
+        except Exception as exc:
+            logger.exception("write-behind batch of %d messages failed", len(chats))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+                    if self.mode == "async":
+                        # Nobody awaits the future; mark the error as seen.
+                        future.exception()
+            return
+
+        self.batches += 1
+        self.written += sum(i is not None for i in ids)
+        for (_, future), chat_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(chat_id)
+
+    async def _write(self, chats):
+        async with self.session_factory() as db:
+            return await write_chat_batch(db, chats)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "written": self.written,
+        }
+
+
+chat_writer = ChatWriteQueue()
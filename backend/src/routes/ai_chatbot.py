@@ -1,5 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .models import (
     ChatRequest,
     ChatResponse, 
@@ -8,45 +10,137 @@ from .models import (
     UserLogin
 )
 from ..database.models import get_db, User, ChatMessage, ChatSession
+from ..database.writer import chat_writer
+from ..database.transfer import export_ndjson, import_ndjson
+from ..database.purge import session_purger
+from ..database.archive import archive_summary, session_archiver
+from ..database.indexer import history_indexer
 from ..database.db import (
-    create_new_chat,
-    create_new_session,
     create_new_user,
+    start_chat_turn,
+    discard_chat_turn,
+    list_session_messages,
+    list_user_sessions,
+    search_user_messages,
+    get_messages_for_index,
+    get_messages_by_ids,
 )
-from ..utils.security import hash_password, verify_password
-from ..chatbot.ai_model import (
-    AIResponseGenerator
+from ..utils.security import hash_password_async, verify_password_async
+from ..chatbot.providers import (
+    AIResponseGenerator,
+    AIResponseStreamer,
+    coalescer,
+    memory,
+    registry,
+    response_cache,
+    session_prompts,
+    tavily,
+    web_search
 )
-from typing import Optional, List
+from ..chatbot.context_compression import context_compressor
+from ..chatbot.history_index import HISTORY_INDEX_CATCHUP, history_index
+from ..chatbot.memory import MEMORY_FETCH_LIMIT
+from ..chatbot.scheduler import Overloaded, llm_scheduler
+from typing import Optional, List, Literal
 from datetime import datetime, timedelta
+import json
+import logging
+import zstandard
 
-from ..utils.authentication import create_access_token, verify_access_token, get_current_user
+from ..utils.metrics import metrics, stage
+from ..utils.authentication import create_access_token, verify_access_token, get_current_user, invalidate_principal
 
 
 ist_time = (datetime.utcnow() + timedelta(hours=5, minutes=30)).strftime(
     "%Y-%m-%d %H:%M:%S"
 )
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def recall_history(db: AsyncSession, user_id: int, session_id: int, message: str):
+    # Catch the index up with the user's stored messages, then look for
+    # related ones outside the current session (its turns are in memory).
+    # Only a few batches are embedded here; a longer backlog is handed to
+    # the background indexer and searched once it is in.
+    # The reads end their transaction here, so the pooled connection is not
+    # held through the model call.
+    with stage("history_search"):
+        try:
+            caught_up = await history_index.sync(
+                user_id,
+                lambda after_id, limit: get_messages_for_index(db, user_id, after_id, limit),
+                max_batches=HISTORY_INDEX_CATCHUP if history_indexer.running else None
+            )
+            if not caught_up:
+                history_indexer.notify(user_id)
+            hits = await history_index.search(user_id, message, exclude_session=session_id)
+            return await get_messages_by_ids(db, user_id, [h.message_id for h in hits])
+        finally:
+            await db.commit()
+
+
+async def begin_chat_turn(db: AsyncSession, req: ChatRequest, user_id: int, owned: bool = False):
+    """Resolves the session, stores the user message and builds the model's
+    context. Returns ``(session_id, history, discard)``: await ``discard()``
+    when the model turns the request away, to take the message back out."""
+    # Refuse before storing anything while the model queue is full.
+    llm_scheduler.check(user_id)
+
+    # One transaction and one commit: resolve the session, read the history
+    # newer than the cached rolling summary, store the user message.
+    with stage("db_chat_turn"):
+        session_id, messages, message_id, created = await start_chat_turn(
+            db=db,
+            session_id=req.session_id,
+            user_id=user_id,
+            title="Chat "+ ist_time,
+            message=req.message,
+            history_after=memory.summary_cursor(req.session_id) if req.session_id else 0,
+            history_limit=MEMORY_FETCH_LIMIT,
+            owned=owned
+        )
+
+    async def discard():
+        await discard_chat_turn(db, session_id, message_id, created)
+
+    try:
+        with stage("memory"):
+            history = await memory.build(session_id, messages)
+        if req.use_history_search:
+            history.recalled = await recall_history(db, user_id, session_id, req.message)
+    except Overloaded:
+        await discard()
+        raise
+    # A new session gets its id here; the model layer keys per-session state on it.
+    req.session_id = session_id
+    return session_id, history, discard
 
 
 @router.post("/register", response_model=UserRegisterResponse)
 async def register_user(
         req: UserRegister, 
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
     ):
-    existing_user = db.query(User).filter(User.user_email_id == req.user_email_id).first()
+    existing_user = await db.scalar(select(User).where(User.user_email_id == req.user_email_id))
 
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    user = create_new_user(
+    with stage("password_hash"):
+        hashed_password = await hash_password_async(req.user_password)
+
+    user = await create_new_user(
         db=db,
         user_name=req.user_name,
         user_email_id=req.user_email_id,
-        user_password=hash_password(req.user_password)
+        user_password=hashed_password
     )
 
     return {
@@ -62,11 +156,14 @@ async def register_user(
 @router.post("/login")
 async def login_user(
         req: UserLogin, 
-        db: Session=Depends(get_db)
+        db: AsyncSession=Depends(get_db)
     ):
-    user = db.query(User).filter(User.user_email_id == req.user_email_id).first()
+    user = await db.scalar(select(User).where(User.user_email_id == req.user_email_id))
+
+    with stage("password_verify"):
+        valid = user is not None and await verify_password_async(req.user_password, user.user_password)
 
-    if not user or verify_password(hash_password(req.user_password), user.user_password):
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid Credentails")
     
     access_token = create_access_token({"user_id": user.id})
@@ -84,72 +181,159 @@ async def login_user(
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
         req: ChatRequest, 
-        db: Session = Depends(get_db), 
+        db: AsyncSession = Depends(get_db), 
         current_user: User = Depends(get_current_user)
     ):
 
     req.user_id = current_user.id
 
-    user = db.query(User).filter(User.id == req.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if req.session_id:
-        session = (
-            db.query(ChatSession)
-            .filter(
-                ChatSession.id == req.session_id,
-                ChatSession.user_id == user.id
-            )
-            .first()
+    session_id, history, discard = await begin_chat_turn(db, req, current_user.id)
+
+    try:
+        with stage("generate"):
+            result = await AIResponseGenerator(req, history)
+    except Overloaded:
+        await discard()
+        raise
+
+    with stage("db_write"):
+        await chat_writer.append(
+            db=db,
+            session_id=session_id,
+            sender='ai',
+            message=result["answer"],
+            urls=result["urls"]
         )
-        if session is None:
-            session = create_new_session(
+    history_indexer.notify(current_user.id)
+
+    return ChatResponse(
+        response=result["answer"],
+        sources=result["urls"],
+        session_id=session_id
+    )
+
+@router.post("/chat/stream")
+async def chat_stream(
+        req: ChatRequest,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+    ):
+
+    req.user_id = current_user.id
+
+    session_id, history, discard = await begin_chat_turn(db, req, current_user.id)
+
+    try:
+        with stage("generate_setup"):
+            urls, tokens = await AIResponseStreamer(req, history)
+    except Overloaded:
+        await discard()
+        raise
+
+    async def event_stream():
+        yield format_sse("start", {"session_id": session_id, "sources": urls})
+
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield format_sse("token", {"token": token})
+        except Exception:
+            logger.exception("chat stream failed")
+            yield format_sse("error", {"detail": "Chat stream failed"})
+            return
+
+        # Persist the reply once, after the last token, instead of per chunk.
+        answer = "".join(parts)
+        with stage("db_write"):
+            message_id = await chat_writer.append(
                 db=db,
-                title="Chat "+ ist_time,
-                user_id=user.id
+                session_id=session_id,
+                sender='ai',
+                message=answer,
+                urls=urls
             )
-    else:
-        session = create_new_session(
-            db=db, 
-            title="Chat "+ ist_time,
-            user_id=user.id
-        )
-    create_new_chat(
-        db=db,
-        session_id=session.id,
-        sender='user',
-        message=req.message,
-        urls=[]
+        history_indexer.notify(current_user.id)
+        yield format_sse("end", {"session_id": session_id, "message_id": message_id})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
-    result = AIResponseGenerator(req)
+# The same component stats, as untyped series on /metrics.
+for prefix, collect in (
+        ("search_cache", tavily.stats),
+        ("search_fanout", web_search.stats),
+        ("response_cache", response_cache.stats),
+        ("prompt_prefix", session_prompts.stats),
+        ("single_flight", coalescer.stats),
+        ("history_index", history_index.stats),
+        ("history_indexer", history_indexer.stats),
+        ("session_purge", session_purger.stats),
+        ("session_archive", session_archiver.stats),
+        ("web_context", context_compressor.stats),
+        ("write_behind", chat_writer.stats),
+        ("llm_scheduler", llm_scheduler.stats),
+):
+    metrics.collect(prefix, collect)
 
-    create_new_chat(
-        db=db,
-        session_id=session.id,
-        sender='ai',
-        message=result["answer"],
-        urls=result["urls"]
-    )
 
-    return ChatResponse(
-        response=result["answer"],
-        sources=result["urls"],
-        session_id=session.id
-    )
+@router.get("/stats/cache")
+async def get_cache_stats(
+        current_user: User = Depends(get_current_user)
+    ):
+    return {
+        "search": tavily.stats(),
+        "search_fanout": web_search.stats(),
+        "response": response_cache.stats(),
+        "prompt_prefix": session_prompts.stats(),
+        "single_flight": coalescer.stats(),
+        "history_index": history_index.stats(),
+        "history_indexer": history_indexer.stats(),
+        "web_context": context_compressor.stats(),
+        "write_behind": chat_writer.stats()
+    }
+
+
+@router.get("/stats/providers")
+async def get_provider_stats(
+        current_user: User = Depends(get_current_user)
+    ):
+    return registry.stats()
+
+
+@router.get("/stats/scheduler")
+async def get_scheduler_stats(
+        current_user: User = Depends(get_current_user)
+    ):
+    return llm_scheduler.stats()
+
+
+@router.get("/stats/archive")
+async def get_archive_stats(
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+    ):
+    # Totals over the whole archive table, plus this process's job runs.
+    return {
+        "archive": await archive_summary(db),
+        "job": session_archiver.stats()
+    }
+
 
 @router.get("/users/{user_id}")
 async def get_user_details(
         user_id: int, 
-        db:Session = Depends(get_db), 
+        db:AsyncSession = Depends(get_db), 
         current_user: User = Depends(get_current_user)
     ):
 
     if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -163,68 +347,158 @@ async def get_user_details(
 @router.get("/users/{user_id}/sessions")
 async def get_user_sessions(
         user_id: int,
-        db: Session = Depends(get_db),
+        before: Optional[int] = None,
+        limit: int = Query(100, ge=1, le=500),
+        db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_user)
     ):
 
     if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not Authorized")
     
-    sessions = db.query(ChatSession).filter(ChatSession.user_id == user_id).order_by(ChatSession.created_at.desc()).all()
-    result = []
+    with stage("db_read"):
+        sessions = await list_user_sessions(db=db, user_id=user_id, before=before, limit=limit)
 
-    for s in sessions:
-        result.append({
+    return [
+        {
             "id": s.id,
             "title": s.title,
             "created_at": s.created_at,
-            "last_message": s.messages[-1].message if s.messages else ""
-        })
-
-    return result
+            "last_message": s.last_message or "",
+            "last_message_at": s.last_message_at
+        } for s in sessions
+    ]
 
 @router.get("/users/{user_id}/sessions/{session_id}")
 async def get_sessions_messages(
     user_id:int,
     session_id:int,
-    db:Session = Depends(get_db),
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db:AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     
     if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    messages = db.query(ChatMessage).filter(
-        ChatSession.user_id == current_user.id,
-        ChatMessage.session_id == session_id
-        ).all()
+    with stage("db_read"):
+        messages = await list_session_messages(
+            db=db,
+            user_id=current_user.id,
+            session_id=session_id,
+            before=before,
+            after=after,
+            limit=limit
+        )
     
     return [
         {
             "id":m.id,
             "sender":m.sender,
             "text":m.message,
-            "urls":m.urls.split(",") if m.urls else None,
+            "urls":json.loads(m.urls) if isinstance(m.urls, str) else m.urls,
             "created_at": m.created_at
         } for m in messages
     ]
 
+@router.get("/users/{user_id}/search")
+async def search_user_history(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    offset: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    if db.bind.dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Search needs the SQLite FTS5 index")
+
+    with stage("db_search"):
+        hits = await search_user_messages(
+            db=db,
+            user_id=user_id,
+            query=q,
+            offset=offset,
+            limit=limit
+        )
+
+    return [
+        {
+            "message_id": h.id,
+            "session_id": h.session_id,
+            "session_title": h.title,
+            "sender": h.sender,
+            "snippet": h.snippet,
+            "created_at": h.created_at,
+            "score": round(-h.rank, 4)
+        } for h in hits
+    ]
+
+@router.get("/users/{user_id}/export")
+async def export_user_history(
+    user_id: int,
+    compression: Optional[Literal["zstd"]] = None,
+    current_user: User = Depends(get_current_user)
+):
+
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    filename = f"chat-history-{user_id}.ndjson" + (".zst" if compression else "")
+    return StreamingResponse(
+        export_ndjson(user_id, compression),
+        media_type="application/zstd" if compression else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/users/{user_id}/import")
+async def import_user_history(
+    user_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    compressed = (
+        request.headers.get("content-encoding", "").lower() == "zstd"
+        or request.headers.get("content-type", "").startswith("application/zstd")
+    )
+    try:
+        with stage("db_import"):
+            imported = await import_ndjson(user_id, request.stream(), compressed)
+    except (ValueError, zstandard.ZstdError) as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+    return {
+        "message": "History imported Successfully",
+        **imported
+    }
+
 @router.delete("/users/{user_id}")
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     
     if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    with stage("db_delete"):
+        deleted = await session_purger.delete_user(db, user_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="User not Found")
     
-    db.delete(user)
-    db.commit()
+    invalidate_principal(user_id)
+    history_index.drop(user_id)
 
     return {
         "message": "User deleted Successfully",
@@ -235,26 +509,22 @@ async def delete_user(
 async def delete_user_sessions(
     user_id:int,
     session_id: int,
-    db:Session = Depends(get_db),
+    db:AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     
     if user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    session = db.query(ChatSession).filter(ChatSession.user_id == user_id).first()
-
-    if not session:
+    with stage("db_delete"):
+        deleted = await session_purger.delete_session(db, user_id, session_id)
+    if not deleted:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    db.delete(session)
-    db.commit()
+    memory.forget(session_id)
+    history_index.tombstone(user_id, session_id)
 
     return {
         "message": "Session deleted Successfully",
         "session_id": session_id
     }
-        
-
-
-    
\ No newline at end of file
@@ -27,4 +27,6 @@ class ChatRequest(BaseModel):
     session_id: Optional[int] = None
     user_id: int
     use_web_search: bool = False
-    role: str = "assistant"
\ No newline at end of file
+    role: str = "assistant"
+    bypass_cache: bool = False
+    use_history_search: bool = False
\ No newline at end of file
@@ -0,0 +1,307 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from sqlalchemy import select
+from typing import Dict, Optional, Set
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from .models import ChatRequest
+from .ai_chatbot import begin_chat_turn
+from ..database.models import SessionLocal, User
+from ..database.writer import chat_writer
+from ..database.indexer import history_indexer
+from ..chatbot.providers import AIResponseStreamer
+from ..chatbot.scheduler import Overloaded
+from ..utils.authentication import cache_principal, get_cached_principal, verify_access_token
+from ..utils.metrics import metrics, stage
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a connection without an Authorization header has to send
+# {"type": "auth", "token": ...} as its first frame. Tokens are not taken
+# from the query string, which ends up in access logs.
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))
+# The server pings after this many quiet seconds, and closes a connection
+# that sent nothing for WS_IDLE_TIMEOUT while no turn was running.
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+# Chat turns one connection may run at once, across its sessions.
+WS_MAX_TURNS = int(os.getenv("WS_MAX_TURNS", "4"))
+# Outgoing frames buffered per connection. When the buffer is full, token
+# streams wait for the client instead of piling up in memory; a client that
+# takes WS_SEND_TIMEOUT to accept one frame is disconnected.
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "64"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+
+router = APIRouter()
+
+_counters = {"connections": 0, "open": 0, "turns": 0, "idle_closed": 0, "slow_closed": 0}
+
+
+def ws_stats() -> dict:
+    return dict(_counters)
+
+
+metrics.collect("ws_chat", ws_stats)
+
+
+async def authenticate(websocket: WebSocket) -> Optional[tuple]:
+    token = None
+    header = websocket.headers.get("authorization", "")
+    if header.lower().startswith("bearer "):
+        token = header[7:]
+    if token is None:
+        # Browsers cannot set headers on a WebSocket handshake.
+        frame = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+        if isinstance(frame, dict) and frame.get("type") == "auth":
+            token = frame.get("token")
+
+    payload = verify_access_token(token) if isinstance(token, str) else None
+    if not payload:
+        return None
+
+    user = get_cached_principal(payload.get("user_id"))
+    if user is None:
+        async with SessionLocal() as db:
+            user = await db.scalar(select(User).where(User.id == payload.get("user_id")))
+        if user is None:
+            return None
+        cache_principal(user)
+    return user, payload.get("exp")
+
+
+class ChatConnection:
+    """One authenticated socket carrying chat turns for any number of the
+    user's sessions.
+
+    The user is resolved once, at connect. Sessions this connection has
+    already resolved skip the ownership lookup on later turns. Each turn
+    runs as its own task, tagged with the client's ``id``, and at most one
+    runs per session at a time.
+    """
+
+    def __init__(self, websocket: WebSocket, user: User, expires_at: Optional[int]):
+        self.websocket = websocket
+        self.user = user
+        self.expires_at = expires_at
+        self.sessions: Set[int] = set()
+        self.busy: Set[int] = set()
+        self.turns: Dict[str, asyncio.Task] = {}
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+        self.last_seen = time.monotonic()
+        self.next_id = 0
+
+    async def send(self, frame: dict):
+        await self.outbox.put(frame)
+
+    def send_nowait(self, frame: dict):
+        try:
+            self.outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            pass
+
+    async def _write(self):
+        while True:
+            frame = await self.outbox.get()
+            if frame is None:
+                return
+            await asyncio.wait_for(self.websocket.send_text(json.dumps(frame)), WS_SEND_TIMEOUT)
+
+    async def _read(self) -> Optional[tuple]:
+        # Returns a (code, reason) to close with, or None on disconnect.
+        while True:
+            try:
+                text = await asyncio.wait_for(self.websocket.receive_text(), WS_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                if not self.turns and time.monotonic() - self.last_seen >= WS_IDLE_TIMEOUT:
+                    _counters["idle_closed"] += 1
+                    return status.WS_1000_NORMAL_CLOSURE, "idle timeout"
+                self.send_nowait({"type": "ping"})
+                continue
+            except WebSocketDisconnect:
+                return None
+
+            self.last_seen = time.monotonic()
+            close = await self.handle(text)
+            if close is not None:
+                return close
+
+    async def handle(self, text: str) -> Optional[tuple]:
+        try:
+            frame = json.loads(text)
+            kind = frame.get("type")
+        except (ValueError, AttributeError):
+            await self.send({"type": "error", "id": None, "detail": "Frames must be JSON objects"})
+            return None
+
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "cancel":
+            task = self.turns.get(str(frame.get("id")))
+            if task is not None:
+                task.cancel()
+        elif kind == "chat":
+            if self.expires_at is not None and time.time() >= self.expires_at:
+                await self.send({"type": "error", "id": frame.get("id"), "detail": "Token expired"})
+                return status.WS_1008_POLICY_VIOLATION, "token expired"
+            await self.start_turn(frame)
+        else:
+            await self.send({"type": "error", "id": frame.get("id"), "detail": f"Unknown frame type {kind!r}"})
+        return None
+
+    async def start_turn(self, frame: dict):
+        if frame.get("id") is None:
+            self.next_id += 1
+            frame["id"] = f"turn-{self.next_id}"
+        turn_id = str(frame["id"])
+
+        fields = {k: v for k, v in frame.items() if k not in ("type", "id")}
+        try:
+            req = ChatRequest(**{**fields, "user_id": self.user.id})
+        except ValidationError as exc:
+            await self.send({"type": "error", "id": turn_id, "detail": json.loads(exc.json())})
+            return
+
+        if turn_id in self.turns:
+            detail = "A turn with this id is already running"
+        elif len(self.turns) >= WS_MAX_TURNS:
+            detail = f"At most {WS_MAX_TURNS} turns may run at once"
+        elif req.session_id is not None and req.session_id in self.busy:
+            detail = "A turn is already running in this session"
+        else:
+            detail = None
+        if detail:
+            await self.send({"type": "error", "id": turn_id, "detail": detail})
+            return
+
+        if req.session_id is not None:
+            self.busy.add(req.session_id)
+        task = asyncio.create_task(self._turn(turn_id, req))
+        self.turns[turn_id] = task
+        task.add_done_callback(lambda _: self.turns.pop(turn_id, None))
+        _counters["turns"] += 1
+
+    async def _turn(self, turn_id: str, req: ChatRequest):
+        session_id = req.session_id
+        owned = session_id in self.sessions
+        try:
+            async with SessionLocal() as db:
+                session_id, history, discard = await begin_chat_turn(db, req, self.user.id, owned=owned)
+                self.sessions.add(session_id)
+                self.busy.add(session_id)
+
+                try:
+                    with stage("generate_setup"):
+                        urls, tokens = await AIResponseStreamer(req, history)
+                except Overloaded:
+                    await discard()
+                    # A session opened by this turn is gone again.
+                    self.sessions.discard(session_id)
+                    raise
+                await self.send({"type": "start", "id": turn_id, "session_id": session_id, "sources": urls})
+
+                parts = []
+                try:
+                    async for token in tokens:
+                        parts.append(token)
+                        await self.send({"type": "token", "id": turn_id, "token": token})
+                finally:
+                    if hasattr(tokens, "aclose"):
+                        await tokens.aclose()
+
+                with stage("db_write"):
+                    message_id = await chat_writer.append(
+                        db=db,
+                        session_id=session_id,
+                        sender='ai',
+                        message="".join(parts),
+                        urls=urls
+                    )
+                history_indexer.notify(self.user.id)
+                await self.send({"type": "end", "id": turn_id, "session_id": session_id, "message_id": message_id})
+        except asyncio.CancelledError:
+            self.send_nowait({"type": "cancelled", "id": turn_id})
+            raise
+        except Overloaded as exc:
+            await self.send({"type": "error", "id": turn_id, "detail": exc.detail,
+                             "status": exc.status_code, "retry_after": exc.retry_after})
+        except Exception:
+            logger.exception("websocket chat turn failed")
+            # The session may have been deleted meanwhile; look it up again.
+            self.sessions.discard(session_id)
+            await self.send({"type": "error", "id": turn_id, "detail": "Chat turn failed"})
+        finally:
+            self.busy.discard(session_id)
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), 5)
+        except Exception:
+            pass
+
+    async def serve(self):
+        _counters["connections"] += 1
+        _counters["open"] += 1
+        writer = asyncio.create_task(self._write())
+        reader = asyncio.create_task(self._read())
+        close = None
+        try:
+            await asyncio.wait({writer, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if reader.done() and not reader.cancelled():
+                if reader.exception() is not None:
+                    logger.error("websocket reader failed", exc_info=reader.exception())
+                    close = status.WS_1011_INTERNAL_ERROR, "internal error"
+                else:
+                    close = reader.result()
+            elif writer.done() and not writer.cancelled() and isinstance(writer.exception(), asyncio.TimeoutError):
+                _counters["slow_closed"] += 1
+                close = status.WS_1008_POLICY_VIOLATION, "client too slow"
+        finally:
+            _counters["open"] -= 1
+            reader.cancel()
+            turns = list(self.turns.values())
+            for task in turns:
+                task.cancel()
+            if turns:
+                await asyncio.gather(*turns, return_exceptions=True)
+
+            if close is not None and not writer.done():
+                # Flush what is queued (a closing error included) first.
+                async def drain():
+                    await self.outbox.put(None)
+                    await writer
+                try:
+                    await asyncio.wait_for(drain(), WS_SEND_TIMEOUT)
+                except Exception:
+                    pass
+            writer.cancel()
+            if close is not None:
+                await self._close(*close)
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        with stage("auth"):
+            principal = await authenticate(websocket)
+    except (asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        principal = None
+
+    if principal is None:
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid_token")
+        except RuntimeError:
+            pass
+        return
+
+    user, expires_at = principal
+    await websocket.send_text(json.dumps({"type": "ready", "user_id": user.id}))
+    await ChatConnection(websocket, user, expires_at).serve()
@@ -1,5 +1,6 @@
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -7,25 +8,61 @@ from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer, Se
 from fastapi.openapi.models import OAuthFlow as OAuthFlowsModel
 
 from ..database.models import User, get_db
+from .metrics import stage
+from collections import OrderedDict
+
+import os
+import time
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db:Session=Depends(get_db)):
+# Resolved principals are reused for a few seconds so an authenticated
+# request does not pay a User SELECT. The JWT itself is still verified on
+# every request; the cache only replaces the lookup behind it.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 
-    print("Token received: ", token)
-    payload = verify_access_token(token)
-    print("Decoded payload: ", payload)
+_principals: "OrderedDict[int, tuple]" = OrderedDict()
 
-    if not payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid_token")
-    
-    user = db.query(User).filter(User.id == payload.get("user_id")).first()
+def get_cached_principal(user_id: int):
+    entry = _principals.get(user_id)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        _principals.pop(user_id, None)
+        return None
+    return entry[1]
 
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    return user
+def cache_principal(user: User):
+    if PRINCIPAL_CACHE_TTL <= 0:
+        return
+    _principals[user.id] = (time.monotonic() + PRINCIPAL_CACHE_TTL, user)
+    _principals.move_to_end(user.id)
+    while len(_principals) > PRINCIPAL_CACHE_MAX_ENTRIES:
+        _principals.popitem(last=False)
+
+def invalidate_principal(user_id: int):
+    _principals.pop(user_id, None)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db:AsyncSession=Depends(get_db)):
+    with stage("auth"):
+        payload = verify_access_token(token)
+
+        if not payload:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid_token")
+
+        user = get_cached_principal(payload.get("user_id"))
+        if user is not None:
+            return user
+
+        user = await db.scalar(select(User).where(User.id == payload.get("user_id")))
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        cache_principal(user)
+        return user
 
 SECRET_KEY = "supersecretkey12345"
 ALGORITHM = "HS256"
@@ -0,0 +1,280 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Sequence
+
+import json
+import logging
+import math
+import os
+import random
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+# Share of requests that get a trace: their stage spans are logged as one
+# JSON line at the end of the request. 0 turns tracing off.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(
+            self,
+            name: str,
+            help: str,
+            labels: Sequence[str] = (),
+            buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: bucket counts (not cumulative), sum, count.
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _labels(self.labels + ("le",), key + (_number(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {count}"
+
+
+class StatsCollector:
+    """Exports the numeric fields of a component's ``stats()`` dict as
+    ``{prefix}_{field}`` at scrape time. They are a mix of running totals
+    and current values, so they are exposed untyped."""
+
+    def __init__(self, prefix: str, stats: Callable[[], dict]):
+        self.prefix = prefix
+        self.stats = stats
+
+    def render(self):
+        for field, value in self.stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{field}"
+            yield f"# TYPE {name} untyped"
+            yield f"{name} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collect(self, prefix: str, stats: Callable[[], dict]):
+        self.register(StatsCollector(prefix, stats))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logger.exception("metrics collector %s failed", getattr(metric, "prefix", metric))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Registry()
+
+http_requests = metrics.counter(
+    "http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+)
+http_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Time from request to the last byte of the response, streams included.",
+    ("method", "route")
+)
+stage_duration = metrics.histogram(
+    "chat_stage_duration_seconds", "Time spent in each stage of a request.", ("stage",)
+)
+stage_errors = metrics.counter(
+    "chat_stage_errors_total", "Stages that ended with an exception.", ("stage",)
+)
+llm_ttft = metrics.histogram(
+    "llm_time_to_first_token_seconds", "Time from starting a generation to its first chunk.", ("model",)
+)
+llm_generation = metrics.histogram(
+    "llm_generation_duration_seconds", "Time from starting a generation to its last chunk.", ("model",)
+)
+llm_tokens_per_second = metrics.histogram(
+    "llm_tokens_per_second", "Output tokens per second after the first token.", ("model",), RATE_BUCKETS
+)
+llm_output_tokens = metrics.counter("llm_output_tokens_total", "Generated tokens.", ("model",))
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, name: str, start: float, end: float, error: bool = False):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+            **({"error": True} if error else {})
+        })
+
+    def finish(self, **fields):
+        logger.info(json.dumps({
+            "trace_id": self.id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            **fields,
+            "spans": self.spans
+        }))
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Times a block into ``chat_stage_duration_seconds`` and, when the
+    request is sampled, into its trace."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        end = time.perf_counter()
+        stage_duration.observe(end - start, stage=name)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(name, start, end, error)
+
+
+async def meter_stream(chunks, model: str, count_tokens: Callable[[str], int]):
+    """Passes ``chunks`` through, recording time to first token, total
+    generation time and output tokens per second."""
+    start = time.perf_counter()
+    first = None
+    parts = []
+    try:
+        async for chunk in chunks:
+            if first is None:
+                first = time.perf_counter()
+                llm_ttft.observe(first - start, model=model)
+            parts.append(chunk)
+            yield chunk
+    finally:
+        end = time.perf_counter()
+        llm_generation.observe(end - start, model=model)
+        trace = current_trace.get()
+        if trace is not None:
+            if first is not None:
+                trace.add("llm_first_token", start, first)
+            trace.add("llm_generate", start, end)
+        if first is not None and parts:
+            tokens = count_tokens("".join(parts))
+            llm_output_tokens.inc(tokens, model=model)
+            if end > first:
+                llm_tokens_per_second.observe(tokens / (end - first), model=model)
+
+
+class MetricsMiddleware:
+    """HTTP request metrics and trace sampling. Requests are labelled by
+    route template (``scope["route"]``, set by the router), so ids in paths
+    do not multiply the series; unmatched paths share one label. The
+    duration ends when the app returns, after the last chunk of a stream."""
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+        trace = Trace(f"{scope['method']} {scope['path']}") if random.random() < self.sample_rate else None
+        token = current_trace.set(trace)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_trace.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(method=scope["method"], route=route, status=status)
+            http_duration.observe(time.perf_counter() - start, method=scope["method"], route=route)
+            if trace is not None:
+                trace.finish(route=route, status=status)
@@ -1,11 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import asyncio
+import os
+
+# Each extra round doubles the cost; 12 is roughly 250 ms per hash on a
+# typical server core.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a small dedicated pool runs hashes in
+# parallel without starving the default threadpool used by FastAPI.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    print(password)
-    print(hashed_password)
     return pwd_context.verify(password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(bcrypt_pool, hash_password, password)
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(bcrypt_pool, verify_password, password, hashed_password)
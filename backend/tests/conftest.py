@@ -0,0 +1,42 @@
+import os
+import tempfile
+import uuid
+
+# Settings are read at import time, so they are pointed at a scratch
+# directory before the app is imported.
+_workdir = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_workdir, 'chat.db')}"
+os.environ["HISTORY_INDEX_DIR"] = os.path.join(_workdir, "history_index")
+os.environ["SEARCH_CACHE_PATH"] = ""
+os.environ["LLM_WARMUP"] = "false"
+os.environ.setdefault("TAVILY_API_KEY", "test")
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from src.app import app  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client():
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
+
+
+@pytest.fixture
+async def user(client):
+    """A freshly registered user, as ``(auth headers, user_id)``."""
+    email = f"{uuid.uuid4().hex}@example.com"
+    await client.post("/api/register", json={
+        "user_name": "test", "user_email_id": email, "user_password": "password"
+    })
+    r = await client.post("/api/login", json={"user_email_id": email, "user_password": "password"})
+    body = r.json()
+    return {"Authorization": f"Bearer {body['access_token']}"}, body["user_id"]
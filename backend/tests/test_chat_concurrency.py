@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+import pytest
+
+from src.routes import ai_chatbot
+
+pytestmark = pytest.mark.anyio
+
+LATENCY = 0.5
+REQUESTS = 8
+
+
+async def test_chat_requests_overlap(client, user, monkeypatch):
+    # /chat must await the model instead of blocking the event loop, so
+    # concurrent requests take about one model call, not one each.
+    async def slow_generator(req, history=None):
+        await asyncio.sleep(LATENCY)
+        return {"answer": f"reply to {req.message}", "urls": []}
+
+    monkeypatch.setattr(ai_chatbot, "AIResponseGenerator", slow_generator)
+    headers, user_id = user
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(
+        client.post("/api/chat", headers=headers, json={"message": f"message {i}", "user_id": user_id})
+        for i in range(REQUESTS)
+    ))
+    elapsed = time.perf_counter() - start
+
+    assert [r.status_code for r in responses] == [200] * REQUESTS
+    assert sorted(r.json()["response"] for r in responses) == sorted(
+        f"reply to message {i}" for i in range(REQUESTS)
+    )
+    assert elapsed < REQUESTS * LATENCY / 3
@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.chatbot.history_index import HistoryIndex
+
+pytestmark = pytest.mark.anyio
+
+
+def table(count: int):
+    rows = [SimpleNamespace(id=i, session_id=1, message=f"message {i}") for i in range(1, count + 1)]
+
+    async def load(after_id: int, limit: int):
+        await asyncio.sleep(0)
+        return [r for r in rows if r.id > after_id][:limit]
+
+    return load
+
+
+async def test_index_being_synced_is_not_evicted(tmp_path):
+    index = HistoryIndex(str(tmp_path), dim=16, max_open=1)
+    release = asyncio.Event()
+    load = table(3)
+
+    async def slow_load(after_id: int, limit: int):
+        await release.wait()
+        return await load(after_id, limit)
+
+    sync = asyncio.create_task(index.sync(1, slow_load, batch=2))
+    await asyncio.sleep(0)
+    syncing = index._users[1]
+
+    index._user(2)
+    assert index._users[1] is syncing
+
+    release.set()
+    assert await sync
+    assert syncing.rows == 3
+    index._user(3)
+    assert list(index._users) == [3]
+
+
+async def test_bounded_sync_leaves_the_backlog(tmp_path):
+    index = HistoryIndex(str(tmp_path), dim=16)
+    load = table(5)
+
+    assert not await index.sync(1, load, batch=2, max_batches=1)
+    assert index._users[1].rows == 2
+
+    async with index._users[1].lock:
+        assert not await index.sync(1, load, batch=2, max_batches=1)
+    assert index._users[1].rows == 2
+
+    assert await index.sync(1, load, batch=2)
+    assert index._users[1].rows == 5
@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from src.database.db import list_session_messages
+from src.database.models import ChatMessage, ChatSession, SessionLocal, engine
+
+pytestmark = pytest.mark.anyio
+
+MESSAGES = 50
+PAGE = 8
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+async def seed_session(user_id: int) -> tuple:
+    start = datetime(2024, 1, 1)
+    async with SessionLocal() as db:
+        session = ChatSession(user_id=user_id, title="paging")
+        db.add(session)
+        await db.flush()
+        messages = [
+            ChatMessage(
+                session_id=session.id,
+                sender="user" if i % 2 == 0 else "ai",
+                message=f"message {i}",
+                urls="[]",
+                created_at=start + timedelta(seconds=i)
+            ) for i in range(MESSAGES)
+        ]
+        db.add_all(messages)
+        await db.commit()
+        return session.id, [m.id for m in messages]
+
+
+async def read_page(user_id, session_id, **cursor):
+    async with SessionLocal() as db:
+        with count_queries() as statements:
+            page = await list_session_messages(db, user_id, session_id, limit=PAGE, **cursor)
+    return [m.id for m in page], len(statements)
+
+
+async def test_paging_costs_the_same_queries_per_page(user):
+    # One archive probe plus one page query, however deep the cursor is.
+    _, user_id = user
+    session_id, ids = await seed_session(user_id)
+
+    seen, counts = [], []
+    page, count = await read_page(user_id, session_id)
+    while page:
+        seen = page + seen
+        counts.append(count)
+        page, count = await read_page(user_id, session_id, before=page[0])
+    assert seen == ids
+
+    seen = []
+    page, count = await read_page(user_id, session_id, after=ids[0])
+    while page:
+        seen += page
+        counts.append(count)
+        page, count = await read_page(user_id, session_id, after=page[-1])
+    assert seen == ids[1:]
+
+    assert len(counts) > 2 * (MESSAGES // PAGE)
+    assert set(counts) == {2}
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from src.chatbot import providers
+from src.chatbot.providers import Provider, ProviderRegistry
+from src.chatbot.scheduler import Overloaded
+
+pytestmark = pytest.mark.anyio
+
+
+class Script:
+    """A fake provider call with a scripted latency and outcome."""
+
+    def __init__(self, name: str, delay: float, error: Exception = None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self, req, history=None) -> dict:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return {"answer": self.name, "urls": []}
+
+
+def registry(*scripts: Script, hedge_delay: float = 0) -> ProviderRegistry:
+    return ProviderRegistry([Provider(s.name, s) for s in scripts], hedge_delay=hedge_delay)
+
+
+async def test_ranked_by_moving_p95():
+    slow, fast = Script("slow", 0.05), Script("fast", 0.005)
+    reg = registry(slow, fast)
+    assert [p.name for p in reg.ranked()] == ["slow", "fast"]
+
+    for provider in reg.providers:
+        for _ in range(3):
+            await provider.timed_generate(None)
+
+    assert [p.name for p in reg.ranked()] == ["fast", "slow"]
+    assert (await reg.generate(None))["answer"] == "fast"
+
+
+async def test_failover_in_rank_order():
+    broken, backup = Script("broken", 0, RuntimeError("down")), Script("backup", 0)
+    reg = registry(broken, backup)
+
+    assert (await reg.generate(None))["answer"] == "backup"
+    assert (broken.calls, backup.calls) == (1, 1)
+    assert reg.stats()["broken"]["error_rate"] == 1.0
+    # Demoted: the healthy provider is tried first from now on.
+    assert [p.name for p in reg.ranked()] == ["backup", "broken"]
+
+
+async def test_overloaded_is_not_failed_over():
+    busy, backup = Script("busy", 0, Overloaded("busy", 3, status_code=503)), Script("backup", 0)
+    reg = registry(busy, backup)
+
+    with pytest.raises(Overloaded):
+        await reg.generate(None)
+    assert backup.calls == 0
+    assert reg.stats()["busy"]["error_rate"] == 0.0
+
+
+async def test_demoted_provider_is_probed_again(monkeypatch):
+    monkeypatch.setattr(providers, "LLM_PROBE_INTERVAL", 0.05)
+    flaky, backup = Script("flaky", 0, RuntimeError("down")), Script("backup", 0)
+    reg = registry(flaky, backup)
+    await reg.generate(None)
+    assert reg.ranked()[0].name == "backup"
+
+    flaky.error = None
+    await asyncio.sleep(0.06)
+    assert reg.ranked()[0].name == "flaky"
+    assert (await reg.generate(None))["answer"] == "flaky"
+    assert reg.stats()["flaky"]["error_rate"] == 0.0
+
+
+async def test_hedged_returns_the_winner_and_cancels_the_loser():
+    stuck, quick = Script("stuck", 1.0), Script("quick", 0.02)
+    reg = registry(stuck, quick, hedge_delay=0.05)
+
+    start = time.perf_counter()
+    result = await reg.generate(None)
+
+    assert result["answer"] == "quick"
+    assert time.perf_counter() - start < 0.5
+    await asyncio.sleep(0)
+    assert stuck.cancelled == 1
+    # The loser is charged the time it had run, so it ranks behind.
+    assert [p.name for p in reg.ranked()] == ["quick", "stuck"]
+
+
+async def test_hedged_tasks_are_cancelled_with_the_caller():
+    first, second = Script("first", 1.0), Script("second", 1.0)
+    reg = registry(first, second, hedge_delay=0.05)
+
+    task = asyncio.create_task(reg.generate(None))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0)
+
+    assert (first.calls, first.cancelled, second.calls) == (1, 1, 0)
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from src.chatbot.scheduler import FairScheduler, Overloaded, llm_scheduler
+
+pytestmark = pytest.mark.anyio
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_slots_are_handed_out_round_robin_across_users():
+    scheduler = FairScheduler(concurrency=1, queue_max=8, queue_max_per_user=4, timeout=5)
+    order = []
+
+    async def call(user_id, name, done: asyncio.Event):
+        async with scheduler.slot(user_id):
+            order.append(name)
+            await done.wait()
+
+    gates = {}
+
+    def start(user_id, name):
+        gates[name] = asyncio.Event()
+        return asyncio.create_task(call(user_id, name, gates[name]))
+
+    tasks = [start("a", "a0")]
+    await settle()
+    # One user queues three calls before another user queues one.
+    tasks += [start("a", name) for name in ("a1", "a2", "a3")]
+    await settle()
+    tasks.append(start("b", "b1"))
+    await settle()
+    assert scheduler.stats()["queued"] == 4
+
+    for name in ("a0", "a1", "b1", "a2", "a3"):
+        assert order[-1] == name
+        gates[name].set()
+        await settle()
+    await asyncio.gather(*tasks)
+
+    assert order == ["a0", "a1", "b1", "a2", "a3"]
+    assert scheduler.stats()["active"] == 0
+
+
+async def test_full_queue_is_rejected_with_429():
+    scheduler = FairScheduler(concurrency=1, queue_max=2, queue_max_per_user=1, timeout=5)
+    await scheduler.acquire("a")
+    waiter = asyncio.create_task(scheduler.acquire("a"))
+    await settle()
+
+    # The user's share is used up, others still get in.
+    with pytest.raises(Overloaded) as exc:
+        await scheduler.acquire("a")
+    assert exc.value.status_code == 429
+    other = asyncio.create_task(scheduler.acquire("b"))
+    await settle()
+
+    # Now the whole queue is full.
+    with pytest.raises(Overloaded) as exc:
+        scheduler.check("c")
+    assert exc.value.status_code == 429
+    assert scheduler.stats()["rejected"] == 2
+
+    scheduler.release()
+    scheduler.release()
+    await asyncio.gather(waiter, other)
+    scheduler.release()
+    assert scheduler.stats()["active"] == 0
+
+
+async def test_missed_deadline_is_rejected_with_503():
+    scheduler = FairScheduler(concurrency=1, queue_max=8, timeout=0.05)
+    await scheduler.acquire("a")
+
+    with pytest.raises(Overloaded) as exc:
+        await scheduler.acquire("b")
+
+    assert exc.value.status_code == 503
+    stats = scheduler.stats()
+    assert (stats["timed_out"], stats["queued"], stats["queued_users"]) == (1, 0, 0)
+    # The abandoned wait does not take the slot when it frees up.
+    scheduler.release()
+    assert scheduler.stats()["active"] == 0
+
+
+async def test_retry_after_covers_the_queue_ahead():
+    scheduler = FairScheduler(concurrency=2, queue_max=8, timeout=5)
+    assert scheduler.retry_after() == 1
+
+    scheduler.service_times.extend([3.0, 4.0, 5.0])
+    assert scheduler.retry_after() == 2
+
+    scheduler.active = 2
+    waiters = [asyncio.create_task(scheduler.acquire(user)) for user in ("a", "b", "c")]
+    await settle()
+    # Four service times of 4s each (three queued plus the caller), two at a time.
+    assert scheduler.retry_after() == 8
+
+    for _ in waiters:
+        scheduler.release()
+    await asyncio.gather(*waiters)
+
+
+async def test_overloaded_chat_gets_retry_after_header(client, user, monkeypatch):
+    headers, user_id = user
+    monkeypatch.setattr(llm_scheduler, "active", llm_scheduler.concurrency)
+    monkeypatch.setattr(llm_scheduler, "queue_max", 0)
+    monkeypatch.setattr(llm_scheduler, "queued", 1)
+
+    r = await client.post("/api/chat", headers=headers, json={"message": "hello", "user_id": user_id})
+
+    assert r.status_code == 429
+    assert r.headers["Retry-After"] == str(llm_scheduler.retry_after())
+    # The refused message was not stored.
+    sessions = await client.get(f"/api/users/{user_id}/sessions", headers=headers)
+    assert sessions.json() == []
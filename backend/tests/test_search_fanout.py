@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from src.chatbot.search_fanout import SearchFanout, query_variants
+
+pytestmark = pytest.mark.anyio
+
+QUESTION = "How tall is the Eiffel Tower and when was it built?"
+
+
+class FakeTavily:
+    """Answers each query from a script: a list of result URLs, an
+    exception to raise, or ``None`` to hang past any deadline."""
+
+    def __init__(self, script: dict):
+        self.script = script
+        self.queries = []
+        self.cancelled = 0
+
+    async def ainvoke(self, payload: dict) -> dict:
+        query = payload["query"]
+        self.queries.append(query)
+        outcome = self.script[query]
+        if outcome is None:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return {
+            "results": [{"url": url, "title": url, "content": query} for url in outcome],
+            "answer": f"answer to {query}",
+        }
+
+
+def fanout(script_for_variants, **kwargs) -> tuple:
+    variants = query_variants(QUESTION, 3)
+    client = FakeTavily(dict(zip(variants, script_for_variants)))
+    return SearchFanout(client, queries=3, enabled=True, **kwargs), client, variants
+
+
+async def test_disabled_passes_the_query_through():
+    client = FakeTavily({QUESTION: ["https://a.example/"]})
+    result = await SearchFanout(client, enabled=False).ainvoke({"query": QUESTION})
+
+    assert client.queries == [QUESTION]
+    assert [r["url"] for r in result["results"]] == ["https://a.example/"]
+
+
+async def test_results_are_interleaved_and_deduplicated_by_url():
+    search, client, variants = fanout([
+        ["https://www.example.com/tower?utm_source=x", "https://a.example/1"],
+        ["https://example.com/tower/", "https://b.example/1"],
+        ["https://c.example/1"],
+    ])
+
+    result = await search.ainvoke({"query": QUESTION})
+
+    assert sorted(client.queries) == sorted(variants)
+    assert [r["url"] for r in result["results"]] == [
+        "https://www.example.com/tower?utm_source=x",
+        "https://c.example/1",
+        "https://a.example/1",
+        "https://b.example/1",
+    ]
+    assert result["answer"] == f"answer to {variants[0]}"
+    assert search.stats()["duplicates"] == 1
+
+
+async def test_a_failed_variant_only_costs_its_results():
+    search, _, variants = fanout([
+        RuntimeError("rate limited"),
+        ["https://a.example/1"],
+        ["https://b.example/1"],
+    ])
+
+    result = await search.ainvoke({"query": QUESTION})
+
+    assert [r["url"] for r in result["results"]] == ["https://a.example/1", "https://b.example/1"]
+    assert result["answer"] == f"answer to {variants[1]}"
+    assert search.stats()["failed"] == 1
+
+
+async def test_variants_past_the_deadline_are_dropped_and_cancelled():
+    search, client, _ = fanout([
+        ["https://a.example/1"],
+        None,
+        None,
+    ], deadline=0.05)
+
+    result = await search.ainvoke({"query": QUESTION})
+    await asyncio.sleep(0)
+
+    assert [r["url"] for r in result["results"]] == ["https://a.example/1"]
+    assert search.stats()["timed_out"] == 2
+    assert client.cancelled == 2
+
+
+async def test_every_variant_failing_returns_no_results():
+    search, _, _ = fanout([RuntimeError("down")] * 3)
+
+    result = await search.ainvoke({"query": QUESTION})
+
+    assert result["results"] == []
+    assert result["answer"] is None